@@ -0,0 +1,92 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Cached k-means elbow curve of principal components
+
+from collections import OrderedDict, namedtuple
+from apps import decomposition
+from lazy import lazy
+import numpy as np
+
+cluster = lazy('sklearn.cluster')
+joblib = lazy('joblib')
+threadpoolctl = lazy('threadpoolctl')     # installed with scikit-learn
+
+# elbow curve is computed for 1 .. MAX_CLUSTERS - 1 clusters
+MAX_CLUSTERS = 20
+# larger datasets are clustered by MiniBatchKMeans
+MINIBATCH_MIN_SAMPLES = 10000
+# threads fitting different numbers of clusters, -1 for all cores
+ELBOW_JOBS = -1
+# elbow curves kept in memory of one worker
+MEMORY_ELBOWS = 16
+
+Elbow = namedtuple('Elbow', ['clusters', 'inertias', 'models'])
+
+_elbows = OrderedDict()                 # (dataset, view, components): Elbow, least recently used first
+
+
+def fit_kmeans(features, n_clusters):
+    """
+    Fits k-means, MiniBatchKMeans above MINIBATCH_MIN_SAMPLES.
+
+    :param features: samples x principal components
+    :param n_clusters: number of clusters
+    :return: fitted model
+    """
+    if len(features) >= MINIBATCH_MIN_SAMPLES:
+        model = cluster.MiniBatchKMeans(n_clusters=n_clusters, random_state=1)
+    else:
+        model = cluster.KMeans(n_clusters=n_clusters, random_state=1)
+    return model.fit(features)
+
+
+def elbow(dataset, n_components) -> Elbow:
+    """
+    K-means inertias for every number of clusters, computed once per dataset and components.
+
+    Numbers of clusters are fitted in parallel threads, sklearn releases GIL while fitting.
+    Every fit is then limited to one OpenMP and BLAS thread, otherwise each of cores threads
+    would start threads on all cores.
+    Fitted models are kept, so selecting number of clusters reuses their labels.
+
+    :param dataset: dataset handle, see datastore.filter_view
+    :param n_components: number of principal components
+    :return: Elbow with list of cluster numbers, inertias and models {n_clusters: model}
+    """
+    key = (dataset['dataset'], dataset.get('view'), n_components)
+    if key in _elbows:
+        _elbows.move_to_end(key)
+        return _elbows[key]
+
+    features = decomposition.decompose(dataset).features[:, :n_components]
+    # reduce number of computed clusters in case of larger datasets
+    clusters = list(range(1, min(len(features), MAX_CLUSTERS)))
+    print(f'cluster range: {clusters}')
+    with threadpoolctl.threadpool_limits(1):
+        models = joblib.Parallel(n_jobs=ELBOW_JOBS, prefer='threads')(
+            joblib.delayed(fit_kmeans)(features, n_clusters) for n_clusters in clusters
+        )
+    _elbows[key] = Elbow(
+        clusters,
+        np.array([model.inertia_ for model in models]),
+        dict(zip(clusters, models))
+    )
+    while len(_elbows) > MEMORY_ELBOWS:
+        _elbows.popitem(last=False)
+    return _elbows[key]
+
+
+def labels(dataset, n_components, n_clusters) -> np.ndarray:
+    """
+    Cluster of every sample, taken from models fitted for elbow curve.
+
+    :param dataset: dataset handle
+    :param n_components: number of principal components
+    :param n_clusters: selected number of clusters
+    :return: array of cluster labels
+    """
+    models = elbow(dataset, n_components).models
+    if n_clusters not in models:
+        features = decomposition.decompose(dataset).features[:, :n_components]
+        models[n_clusters] = fit_kmeans(features, n_clusters)
+    return models[n_clusters].labels_
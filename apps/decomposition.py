@@ -0,0 +1,50 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Per-dataset cache of principal components
+
+from dash.exceptions import PreventUpdate
+from collections import OrderedDict, namedtuple
+from apps import sparse_data
+import datastore
+
+# components computed once per dataset, any smaller number is served by slicing
+MAX_COMPONENTS = 4
+# decompositions kept in memory of one worker
+MEMORY_DECOMPOSITIONS = 8
+
+Decomposition = namedtuple('Decomposition', ['features', 'explained_variance_ratio', 'filenames'])
+
+_decompositions = OrderedDict()         # (dataset, view): Decomposition, least recently used first
+
+
+def decompose(dataset) -> Decomposition:
+    """
+    Principal components of dataset, computed by one SVD per dataset and view.
+
+    Datasets of OUT_OF_CORE_MIN_ROWS rows and more are decomposed out of core,
+    streamed in row chunks from memory mapped matrix.
+    First n columns of features are projection to n principal components,
+    so slider moves and cluster clicks never refit.
+
+    :param dataset: dataset handle, see datastore.filter_view
+    :return: Decomposition with features of MAX_COMPONENTS columns
+    """
+    if dataset is None:
+        # nothing extracted yet
+        raise PreventUpdate
+    key = (dataset['dataset'], dataset.get('view'))
+    if key in _decompositions:
+        _decompositions.move_to_end(key)
+        return _decompositions[key]
+
+    print(f'decomposing dataset {dataset["dataset"][:8]}, view {dataset.get("view")}')
+    if dataset['rows'] >= datastore.OUT_OF_CORE_MIN_ROWS:
+        features, explained_variance_ratio = sparse_data.incremental_pca(dataset, MAX_COMPONENTS)
+        filenames = datastore.load_files(dataset)
+    else:
+        matrix, filenames = sparse_data.load_matrix(dataset)
+        features, explained_variance_ratio = sparse_data.pca(matrix, min(MAX_COMPONENTS, *matrix.shape))
+    _decompositions[key] = Decomposition(features, explained_variance_ratio, filenames)
+    while len(_decompositions) > MEMORY_DECOMPOSITIONS:
+        _decompositions.popitem(last=False)
+    return _decompositions[key]
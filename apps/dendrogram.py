@@ -3,13 +3,15 @@
 # Desc.: Dendrogram application page
 
 from dash.dependencies import Input, Output
-from sklearn.decomposition import PCA
 import dash_html_components as html
 import dash_core_components as dcc
-import plotly.figure_factory as ff              # dendrogram
 from apps import graph_settings                 # custom colors, layout, zoom and hidden modebar
-import pandas as pd
+from apps import decomposition
+from lazy import lazy
 from app import app
+import metrics
+
+ff = lazy('plotly.figure_factory')              # dendrogram
 
 layout = html.Div(
     [  # row-dendrogram
@@ -47,13 +49,14 @@ layout = html.Div(
         Output('graph_dendrogram', 'figure'),  # plot dendrogram
         Output('graph_dendrogram', 'config'),   # default zoom, hide modebar
     ],
-    Input('table', 'derived_virtual_data')  # get data from table
+    Input('dataset-view', 'data'),  # handle of filtered dataset stored on server
 )
-def update_dendrogram(rows):
+@metrics.instrument('update_dendrogram')
+def update_dendrogram(dataset):
 
     """
 
-    :param rows: input data from dash_table.DataTable
+    :param dataset: handle of dataset stored on server
     :return: dendrogram graph
     """
 
@@ -63,13 +66,8 @@ def update_dendrogram(rows):
     config = dict({'scrollZoom': True, 'displayModeBar': False})
 
     print(f'updating dendrogram')
-    df_pca = pd.DataFrame(rows)
-    # drop column files in case PDFs were loaded
-    filenames = df_pca['file']
-    # get values only
-    df_pca = df_pca.drop('file', axis=1)
-    pca_in = PCA(n_components=2)
-    features = pca_in.fit_transform(df_pca)
+    # first two principal components, shared with pca page
+    features = decomposition.decompose(dataset).features[:, :2]
 
     # DENDROGRAM
     fig_dendrogram = ff.create_dendrogram(
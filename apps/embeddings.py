@@ -0,0 +1,56 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: On-disk cache of t-SNE and UMAP embeddings
+
+from cache import NpzCache, CACHE_DIR
+import importlib.metadata
+import pandas as pd
+import numpy as np
+import hashlib
+import json
+import os
+
+# embeddings are small, default limit holds thousands of them
+EMBEDDING_CACHE_MAX_BYTES = int(os.environ.get('EMBEDDING_CACHE_MAX_MB', 256)) * 2 ** 20
+# library computing each method, its version is part of cache key
+DISTRIBUTIONS = {'tsne': 'scikit-learn', 'umap': 'umap-learn'}
+
+EMBEDDING_CACHE = NpzCache(os.path.join(CACHE_DIR, 'embeddings'), max_bytes=EMBEDDING_CACHE_MAX_BYTES)
+
+
+def key(method, dataset, params) -> str:
+    """
+    Creates cache key of embedding.
+
+    Fits use fixed random_state, so same dataset content, view, parameters and
+    library version always give same embedding, whichever session asks for it.
+
+    :param method: one of DISTRIBUTIONS
+    :param dataset: dataset handle, see datastore.filter_view
+    :param params: all parameters of the fit
+    :return: cache key
+    """
+    version = importlib.metadata.version(DISTRIBUTIONS[method])
+    fit = json.dumps([dataset['dataset'], dataset.get('view'), params], sort_keys=True)
+    return f'{method}-{version}-{hashlib.sha256(fit.encode()).hexdigest()[:32]}'
+
+
+def get(key) -> np.ndarray:
+    """
+    Loads cached embedding.
+
+    :param key: key from key()
+    :return: samples x components, None when not cached
+    """
+    df = EMBEDDING_CACHE.get(key)
+    if df is None:
+        return None
+    return df.to_numpy()
+
+
+def put(key, features: np.ndarray):
+    EMBEDDING_CACHE.put(key, pd.DataFrame(features))
+
+
+def cached(key) -> bool:
+    return os.path.exists(EMBEDDING_CACHE.path(key))
@@ -0,0 +1,117 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Single trace WebGL scatter figures of large datasets
+
+from apps import graph_settings
+from lazy import lazy
+import pandas as pd
+import numpy as np
+import os
+
+go = lazy('plotly.graph_objects')
+
+# from this number of samples pages draw one WebGL trace instead of one SVG trace per file
+WEBGL_MIN_POINTS = int(os.environ.get('WEBGL_MIN_POINTS', 1000))
+# samples drawn at most, random subset above it, 0 draws all
+MAX_POINTS = int(os.environ.get('MAX_PLOT_POINTS', 50000))
+# significant digits of coordinates sent to browser, relative to their range
+DIGITS = 4
+
+
+def large(n_samples) -> bool:
+    return n_samples >= WEBGL_MIN_POINTS
+
+
+def downsample(n_samples, max_points=MAX_POINTS) -> np.ndarray:
+    """
+    Chooses drawn samples, same subset for same number of samples.
+
+    :param n_samples: number of samples
+    :param max_points: samples drawn at most, 0 for all
+    :return: sorted row positions
+    """
+    if not max_points or n_samples <= max_points:
+        return np.arange(n_samples)
+    return np.sort(np.random.RandomState(1).choice(n_samples, max_points, replace=False))
+
+
+def compact(values) -> np.ndarray:
+    """
+    Rounds coordinates to DIGITS significant digits of their range.
+
+    Shorter numbers keep figure json small, rounding is far below screen resolution.
+    Rounded values are float64, PlotlyJSONEncoder writes float32 5.292 as 5.291999816894531.
+
+    :param values: coordinates of one axis
+    :return: rounded float64 coordinates
+    """
+    values = np.asarray(values, dtype=float)
+    span = float(np.ptp(values)) if len(values) else 0.
+    decimals = DIGITS - int(np.floor(np.log10(span))) if span > 0 else DIGITS
+    return np.round(values, max(decimals, 0))
+
+
+def discrete_colorscale(colors) -> list:
+    # step colorscale, code i gets colors[i] for cmin=-0.5, cmax=len(colors)-0.5
+    scale = []
+    for i, color in enumerate(colors):
+        scale += [[i / len(colors), color], [(i + 1) / len(colors), color]]
+    return scale
+
+
+def marker(codes) -> dict:
+    colors = graph_settings.colors
+    return dict(
+        color=np.asarray(codes) % len(colors),
+        colorscale=discrete_colorscale(colors),
+        cmin=-0.5,
+        cmax=len(colors) - 0.5,
+        size=4,
+    )
+
+
+def scatter(features, filenames, color=None, labels=None) -> 'go.Figure':
+    """
+    Draws samples as one WebGL trace, colored by file like px.scatter(color=filenames).
+
+    Colors are integer codes of one trace instead of one trace per file, coordinates
+    are rounded, and above MAX_POINTS only a random subset is drawn.
+
+    :param features: samples x 2, 3 or 4 components
+    :param filenames: file of every sample, shown on hover
+    :param color: integer code of every sample, e.g. k-means labels, file codes by default
+    :param labels: axis titles, 'PC 1', ... by default
+    :return: figure, layout is left to pages
+    """
+    features = np.asarray(features)
+    n_components = features.shape[1]
+    rows = downsample(len(features))
+    if len(rows) < len(features):
+        print(f'drawing {len(rows)} of {len(features)} samples')
+    filenames = np.asarray(filenames)[rows]
+    if color is None:
+        color = pd.factorize(filenames)[0]
+    else:
+        color = np.asarray(color)[rows]
+    if labels is None:
+        labels = [f'PC {i + 1}' for i in range(n_components)]
+    coordinates = [compact(features[rows, i]) for i in range(n_components)]
+
+    common = dict(text=filenames, hoverinfo='text', marker=marker(color), showlegend=False)
+    if n_components == 2:
+        trace = go.Scattergl(x=coordinates[0], y=coordinates[1], mode='markers', **common)
+    elif n_components == 3:
+        # 3d scatter is drawn by WebGL already
+        trace = go.Scatter3d(x=coordinates[0], y=coordinates[1], z=coordinates[2], mode='markers', **common)
+    else:
+        trace = go.Splom(
+            dimensions=[dict(label=label, values=values) for label, values in zip(labels, coordinates)],
+            diagonal_visible=False,
+            **common
+        )
+    fig = go.Figure(trace)
+    if n_components == 2:
+        fig.update_layout(xaxis_title=labels[0], yaxis_title=labels[1])
+    elif n_components == 3:
+        fig.update_layout(scene=dict(xaxis_title=labels[0], yaxis_title=labels[1], zaxis_title=labels[2]))
+    return fig
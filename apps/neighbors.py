@@ -0,0 +1,106 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Nearest neighbors graph shared by t-SNE and UMAP
+
+from collections import namedtuple
+from apps import sparse_data
+from lazy import lazy
+import numpy as np
+import datastore
+import os
+
+joblib = lazy('joblib')
+pynndescent = lazy('pynndescent')
+sparse = lazy('scipy.sparse')
+
+# smaller datasets are left to t-SNE and UMAP, both compute exact neighbors of them quickly
+KNN_MIN_SAMPLES = 4096
+# neighbors searched at least, default perplexity 30 needs 91, UMAP n_neighbors up to 100
+MIN_NEIGHBORS = 101
+# metrics offered by UMAP page, t-SNE uses euclidean
+METRICS = ['euclidean', 'manhattan', 'chebyshev', 'minkowski']
+
+KnnGraph = namedtuple('KnnGraph', ['indices', 'distances', 'index'])
+
+
+def graph_path(dataset, metric) -> str:
+    if metric not in METRICS:
+        raise ValueError(f'unknown metric: {metric}')
+    # stored with dataset, removed together with its session
+    view = dataset.get('view') or 'all'
+    return datastore.path(dataset)[:-len('.npz')] + f'-{view}-knn-{metric}.joblib'
+
+
+def shared(dataset) -> bool:
+    return dataset['rows'] >= KNN_MIN_SAMPLES
+
+
+def knn(dataset, metric, n_neighbors) -> KnnGraph:
+    """
+    Nearest neighbors of every sample, searched once per dataset, view and metric.
+
+    Graph is searched for MIN_NEIGHBORS neighbors, any smaller number is served
+    by slicing, so changing perplexity, n_neighbors or min_dist never searches again.
+    Larger number searches again and replaces stored graph.
+
+    :param dataset: dataset handle, see datastore.filter_view
+    :param metric: one of METRICS
+    :param n_neighbors: neighbors needed, sample itself included
+    :return: KnnGraph with indices and distances sorted by distance, NNDescent index
+    """
+    path = graph_path(dataset, metric)
+    if os.path.exists(path):
+        graph = joblib.load(path)
+        if graph.indices.shape[1] >= n_neighbors:
+            return graph
+
+    matrix, filenames = sparse_data.load_matrix(dataset)
+    n_neighbors = min(max(n_neighbors, MIN_NEIGHBORS), matrix.shape[0])
+    print(f'searching {n_neighbors} nearest neighbors, metric {metric}')
+    index = pynndescent.NNDescent(
+        # index of sparse data breaks when unpickled, UMAP gets the same dense matrix
+        matrix.toarray(),
+        n_neighbors=n_neighbors,
+        metric=metric,
+        random_state=1,
+        low_memory=True,
+        verbose=True,
+    )
+    indices, distances = index.neighbor_graph
+    graph = KnnGraph(indices, distances, index)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    joblib.dump(graph, tmp_path)
+    os.replace(tmp_path, path)
+    return graph
+
+
+def umap_knn(dataset, metric, n_neighbors) -> tuple:
+    """
+    Precomputed neighbors for UMAP.
+
+    :param dataset: dataset handle
+    :param metric: one of METRICS
+    :param n_neighbors: UMAP n_neighbors
+    :return: (indices, distances, index) for precomputed_knn
+    """
+    graph = knn(dataset, metric, n_neighbors)
+    # UMAP marks disconnected neighbors in place, stored graph stays untouched
+    return graph.indices[:, :n_neighbors].copy(), graph.distances[:, :n_neighbors].copy(), graph.index
+
+
+def tsne_distances(dataset, perplexity) -> 'sparse.csr_matrix':
+    """
+    Precomputed sparse distances for t-SNE, same number of neighbors as t-SNE searches itself.
+
+    :param dataset: dataset handle
+    :param perplexity: t-SNE perplexity
+    :return: csr matrix of euclidean distances, samples x samples, sample itself kept as explicit zero
+    """
+    n_samples = dataset['rows']
+    # t-SNE drops sample itself from its neighbors
+    k = min(n_samples - 1, int(3. * perplexity + 1)) + 1
+    graph = knn(dataset, 'euclidean', k)
+    return sparse.csr_matrix(
+        (graph.distances[:, :k].ravel(), graph.indices[:, :k].ravel(), np.arange(0, n_samples * k + 1, k)),
+        shape=(n_samples, n_samples)
+    )
@@ -3,18 +3,19 @@
 # Desc.: PCA application page
 
 from dash.dependencies import Input, Output
-from sklearn.decomposition import PCA
 import dash_core_components as dcc
 import dash_html_components as html
-from sklearn.cluster import KMeans
-import plotly.graph_objects as go
-from apps import graph_settings
+from apps import graph_settings, decomposition, clustering, figures
+from lazy import lazy
 import pandas as pd
-import plotly.express as px
 from app import app
+import metrics
 import numpy as np
 import dash
 
+go = lazy('plotly.graph_objects')
+px = lazy('plotly.express')
+
 layout = html.Div(
     [  # row-pca
         html.Div(
@@ -101,15 +102,16 @@ layout = html.Div(
         Output('graph_clusters', 'config'),
     ],
     [
-        Input('table', 'derived_virtual_data'),  # get data from table
+        Input('dataset-view', 'data'),  # handle of filtered dataset stored on server
         Input('slider-pca', 'value'),            # get data from slider
         Input('graph_clusters', 'clickData'),    # get data from clusters graph
     ]
 )
-def update_pca(rows, input_components, clusters_selected):
+@metrics.instrument('update_pca')
+def update_pca(dataset, input_components, clusters_selected):
     """
 
-    :param rows: iinput data from table
+    :param dataset: handle of dataset stored on server
     :param input_components: number of principal components
     :param clusters_selected: selected number of clusters
     :return: pca graph, pc graph, k-means graph
@@ -121,14 +123,10 @@ def update_pca(rows, input_components, clusters_selected):
     print(f'updating pca | triggered by: {trigger}')
     print(f'number of clusters selected: {clusters_selected}')
 
-    df_pca = pd.DataFrame(rows)
-    print(f'pca input: {df_pca}')
-    # drop column files in case PDFs were loaded
-    filenames = df_pca['file']
-    # get values only
-    df_pca = df_pca.drop('file', axis=1)
-    pca_in = PCA(n_components=input_components)
-    features = pca_in.fit_transform(df_pca)
+    # components are computed once per dataset, slider only slices them
+    pca_cached = decomposition.decompose(dataset)
+    features = pca_cached.features[:, :input_components]
+    filenames = pca_cached.filenames
 
     # PCA side menu barchart
     if trigger == 'slider-pca':
@@ -136,9 +134,7 @@ def update_pca(rows, input_components, clusters_selected):
         fig_evr = dash.no_update
         graph_settings.config_nozoom = dash.no_update
     else:
-        pca_in4 = PCA(n_components=4)
-        pca_in4.fit_transform(df_pca)
-        ev_ratio = np.round(pca_in4.explained_variance_ratio_ * 100, decimals=1)
+        ev_ratio = np.round(pca_cached.explained_variance_ratio * 100, decimals=1)
         print(f'EVR: {ev_ratio}')
         print(f'features: {features}')
         fig_evr = go.Figure()
@@ -159,16 +155,18 @@ def update_pca(rows, input_components, clusters_selected):
         )
     if clusters_selected is not None:
         nr_clusters = clusters_selected['points'][0]['x']
-        features_reduced = pd.DataFrame(features, index=df_pca.index)
-        kmeans = KMeans(n_clusters=nr_clusters)
-        kmeans.fit(features_reduced)
-        kmeans_model = kmeans.predict(features_reduced)
+        features_reduced = pd.DataFrame(features)
+        # labels of model fitted for elbow curve
+        kmeans_model = clustering.labels(dataset, input_components, nr_clusters)
 
-        if input_components == 2:
+        if figures.large(len(features)):
+            # one WebGL trace colored by clusters
+            pca_kmeans = figures.scatter(features, filenames, color=kmeans_model).data
+        elif input_components == 2:
             pca_kmeans = go.Scatter(
                 x=features_reduced[0],
                 y=features_reduced[1],
-                text=df_pca.index,
+                text=features_reduced.index,
                 name='',
                 mode='markers',
                 marker=dict(
@@ -179,12 +177,12 @@ def update_pca(rows, input_components, clusters_selected):
                 hovertext=filenames,
                 hoverinfo="text",
             )
-        if input_components == 3:
+        elif input_components == 3:
             pca_kmeans = go.Scatter3d(
                 x=features_reduced[0],
                 y=features_reduced[1],
                 z=features_reduced[2],
-                text=df_pca.index,
+                text=features_reduced.index,
                 name='',
                 mode='markers',
                 marker=dict(
@@ -206,6 +204,9 @@ def update_pca(rows, input_components, clusters_selected):
         layout_pk['title'] = f'PCA + k-means: {nr_clusters} clusters)'
         fig_pca = go.Figure(data=pca_kmeans, layout=layout_pk)
 
+    elif figures.large(len(features)):
+        # one WebGL trace instead of one trace per file
+        fig_pca = figures.scatter(features, filenames)
     else:
         if input_components == 2:
             labels = {str(i): "PC {}".format(i + 1) for i in range(2)}
@@ -253,28 +254,16 @@ def update_pca(rows, input_components, clusters_selected):
         showlegend=False,
     )
 
-    #  k-means support graph
-    max_clusters = len(features)
-    # reduce number of computed clusters in case of larger datasets
-    if max_clusters > 20:
-        max_clusters = 20
-
-    # apply k-means checkbox
-    inertias = np.zeros(max_clusters)
-    for i in range(1, max_clusters):
-        kmeans = KMeans(n_clusters=i)
-        kmeans.fit(features)
-        inertias[i] = kmeans.inertia_
-    rangeprint = range(1, max_clusters)
-    print(f'cluster range: {rangeprint}')
+    #  k-means support graph, computed once per dataset and number of components
+    kmeans_elbow = clustering.elbow(dataset, input_components)
     kmeans_data = go.Scatter(
-        x=list(range(1, max_clusters)),
-        y=inertias[1:],
+        x=kmeans_elbow.clusters,
+        y=kmeans_elbow.inertias,
         line=dict(color='#7BFBC5', width=4),
     )
     layout_kmeans = go.Layout(
         title='Select Number of Clusters',
-        xaxis=go.layout.XAxis(title='Number of clusters', range=[0, max_clusters]),
+        xaxis=go.layout.XAxis(title='Number of clusters', range=[0, len(kmeans_elbow.clusters) + 1]),
         yaxis=go.layout.YAxis(title='Inertia')
     )
     fig_clusters = go.Figure(data=kmeans_data, layout=layout_kmeans)
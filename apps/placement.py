@@ -0,0 +1,159 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Fitted UMAP models placing appended samples into stable map
+
+from collections import OrderedDict, namedtuple
+from lazy import lazy
+import pandas as pd
+import numpy as np
+import datastore
+import hashlib
+import json
+import os
+
+joblib = lazy('joblib')
+
+# fitted models kept in memory of one worker
+MEMORY_MODELS = 4
+# fitted models stored per session, oldest are removed, maps without model are fitted again
+SESSION_MODELS = 4
+
+StableModel = namedtuple('StableModel', ['model', 'files', 'columns', 'embedding'])
+
+_models = OrderedDict()                 # model path: StableModel, least recently used first
+
+
+def model_path(dataset, fit_key) -> str:
+    # stored with datasets of session, removed together with it
+    return os.path.join(os.path.dirname(datastore.path(dataset)), f'{fit_key}.joblib')
+
+
+def current_path(dataset, params) -> str:
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:32]
+    return os.path.join(os.path.dirname(datastore.path(dataset)), f'map-{digest}.json')
+
+
+def dump(path, write):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def remove_model(dataset, fit_key):
+    path = model_path(dataset, fit_key)
+    _models.pop(path, None)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def evict(dataset, keep):
+    """
+    Removes models of session beyond SESSION_MODELS, least recently saved first.
+
+    :param dataset: dataset handle of session
+    :param keep: fit key never removed
+    """
+    directory = os.path.dirname(datastore.path(dataset))
+    stored = sorted(
+        (entry.stat().st_mtime, entry.name[:-len('.joblib')]) for entry in os.scandir(directory)
+        if entry.name.endswith('.joblib') and entry.name != f'{keep}.joblib'
+    )
+    for _, fit_key in stored[:max(0, len(stored) - SESSION_MODELS + 1)]:
+        remove_model(dataset, fit_key)
+
+
+def save_model(dataset, params, fit_key, model, embedding):
+    """
+    Stores fitted model and makes it current map of session for its parameters.
+
+    Model replaced as current map of the parameters is removed, so every refit keeps one model,
+    at most SESSION_MODELS models of different parameters are kept.
+    Datasets with more rows per file (xlsx, csv) are not stored, their rows could not be matched later.
+
+    :param dataset: dataset handle the model was fitted on
+    :param params: fit parameters
+    :param fit_key: embedding cache key of the fit
+    :param model: fitted umap.UMAP
+    :param embedding: embedded samples of dataset
+    """
+    data = datastore.load(dataset)
+    if not data.files.is_unique:
+        return
+    stable = StableModel(model, data.files.tolist(), data.columns, embedding)
+    dump(model_path(dataset, fit_key), lambda path: joblib.dump(stable, path))
+    set_current(dataset, params, fit_key)
+    evict(dataset, fit_key)
+
+
+def has_model(dataset, fit_key) -> bool:
+    return os.path.exists(model_path(dataset, fit_key))
+
+
+def set_current(dataset, params, fit_key):
+    def write(path):
+        with open(path, 'w') as f:
+            json.dump({'fit': fit_key}, f)
+    previous = current(dataset, params)
+    dump(current_path(dataset, params), write)
+    if previous is not None and previous != fit_key:
+        # replaced map is not placed into anymore
+        remove_model(dataset, previous)
+
+
+def current(dataset, params) -> str:
+    """
+    Finds current map of session.
+
+    :param dataset: dataset handle
+    :param params: fit parameters
+    :return: fit key of current model, None when session has none
+    """
+    try:
+        with open(current_path(dataset, params)) as f:
+            fit_key = json.load(f)['fit']
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return None
+    return fit_key if has_model(dataset, fit_key) else None
+
+
+def load_model(dataset, fit_key) -> StableModel:
+    path = model_path(dataset, fit_key)
+    if path not in _models:
+        _models[path] = joblib.load(path)
+    _models.move_to_end(path)
+    while len(_models) > MEMORY_MODELS:
+        _models.popitem(last=False)
+    return _models[path]
+
+
+def place(dataset, fit_key) -> np.ndarray:
+    """
+    Places samples of dataset into fitted map.
+
+    Samples the model was fitted on keep their coordinates, only new ones are
+    embedded by transform, so appending files never moves the map.
+
+    :param dataset: dataset handle, see datastore.filter_view
+    :param fit_key: fit key of model from current
+    :return: embedded samples, None when dataset does not extend the map
+    """
+    stable = load_model(dataset, fit_key)
+    data = datastore.load(dataset)
+    if data.columns != stable.columns or not data.files.is_unique:
+        # other features or rows not identified by file
+        return None
+    positions = pd.Index(stable.files).get_indexer(data.files)
+    known = positions >= 0
+    if not known.any():
+        # other study, map would not be comparable
+        return None
+
+    features = np.empty((len(data), stable.embedding.shape[1]))
+    features[known] = stable.embedding[positions[known]]
+    if not known.all():
+        print(f'placing {(~known).sum()} new samples into map {fit_key}')
+        # dense rows, as models are fitted, see umap.embed
+        features[~known] = stable.model.transform(data.dense(~known))
+    return features
@@ -0,0 +1,134 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Sparse feature matrix shared by application pages
+
+from dash.exceptions import PreventUpdate
+from lazy import lazy
+import datastore
+import pandas as pd
+import numpy as np
+
+decomposition = lazy('sklearn.decomposition')
+linalg = lazy('scipy.sparse.linalg')
+sparse = lazy('scipy.sparse')
+
+# smaller matrices are decomposed densely, sparse solver overhead would cost more
+SPARSE_MIN_CELLS = 10 ** 6
+# samples read from disk at once by out-of-core PCA
+CHUNK_ROWS = 2000
+
+
+def load_matrix(dataset) -> ('sparse.csr_matrix', pd.Series):
+    """
+    Loads stored dataset as sparse feature matrix.
+
+    :param dataset: dataset handle, see datastore.save
+    :return: float32 csr matrix without file column, filenames
+    """
+    if dataset is None:
+        # nothing extracted yet
+        raise PreventUpdate
+    data = datastore.load(dataset)
+    filenames = data.files
+    # binned chromatograms are stored sparse already, tables are converted
+    matrix = sparse.csr_matrix(data.matrix)
+    print(f'features: {matrix.shape}, {matrix.nnz} non-zero values')
+    return matrix, filenames
+
+
+def pca(matrix, n_components) -> (np.ndarray, np.ndarray):
+    """
+    Principal component analysis working on sparse matrix.
+
+    Large matrices are never centered in memory, centering is applied implicitly
+    inside matrix products of a sparse SVD, so results equal PCA on dense data.
+
+    :param matrix: csr matrix, samples x features
+    :param n_components: number of principal components
+    :return: projected samples, explained variance ratio
+    """
+    n_samples, n_features = matrix.shape
+    if n_samples * n_features < SPARSE_MIN_CELLS or n_components >= min(matrix.shape):
+        pca_in = decomposition.PCA(n_components=n_components)
+        features = pca_in.fit_transform(matrix.toarray())
+        return features, pca_in.explained_variance_ratio_
+
+    mean = np.asarray(matrix.mean(axis=0)).ravel()
+    centered = linalg.LinearOperator(
+        shape=matrix.shape,
+        matvec=lambda v: matrix @ v - mean @ v,
+        rmatvec=lambda u: matrix.T @ u - mean * u.sum(),
+        dtype=float,
+    )
+    # fixed start vector keeps results deterministic
+    v0 = np.random.RandomState(1).uniform(-1, 1, min(matrix.shape))
+    u, s, vt = linalg.svds(centered, k=n_components, v0=v0)
+    # svds returns ascending singular values
+    order = np.argsort(s)[::-1]
+    u, s, vt = u[:, order], s[order], vt[order]
+    # same sign convention as sklearn PCA, largest projection of each component positive
+    signs = np.sign(u[np.argmax(np.abs(u), axis=0), np.arange(n_components)])
+    u *= signs
+
+    # total variance from sparse column moments, E[x^2] - E[x]^2
+    squares = np.asarray(matrix.multiply(matrix).mean(axis=0)).ravel()
+    total_variance = (squares - mean ** 2).sum() * n_samples / (n_samples - 1)
+    explained_variance = s ** 2 / (n_samples - 1)
+    return u * s, explained_variance / total_variance
+
+
+def iter_chunks(dataset, chunk_rows=CHUNK_ROWS):
+    """
+    Reads feature matrix of dataset or its filtered view in row chunks from memory mapped npy.
+
+    Chunks are of about equal size, none smaller than half of chunk_rows
+    unless the whole matrix is.
+
+    :param dataset: dataset handle, see datastore.filter_view
+    :param chunk_rows: rows per chunk
+    :return: generator of float64 arrays, chunk x features
+    """
+    matrix = datastore.load_features(dataset)
+    rows = datastore.load_rows(dataset)
+    n_samples = len(matrix) if rows is None else len(rows)
+    n_chunks = max(1, int(np.ceil(n_samples / chunk_rows)))
+    bounds = np.linspace(0, n_samples, n_chunks + 1).astype(int)
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        if rows is None:
+            chunk = matrix[start:stop]
+        else:
+            # fancy indexing of memmap reads only selected rows
+            chunk = matrix[rows[start:stop]]
+        yield np.asarray(chunk, dtype=float)
+
+
+def incremental_pca(dataset, n_components) -> (np.ndarray, np.ndarray):
+    """
+    Out-of-core principal component analysis of stored dataset.
+
+    Model is fitted by IncrementalPCA over row chunks, projection is computed
+    chunk by chunk in a second pass, so memory is bounded by chunk size and
+    projected samples whatever the number of rows.
+
+    :param dataset: dataset handle, see datastore.filter_view
+    :param n_components: number of principal components
+    :return: projected samples, explained variance ratio
+    """
+    matrix = datastore.load_features(dataset)
+    n_components = min(n_components, matrix.shape[1])
+    pca_in = decomposition.IncrementalPCA(n_components=n_components)
+    n_samples = 0
+    for chunk in iter_chunks(dataset):
+        pca_in.partial_fit(chunk)
+        n_samples += len(chunk)
+    print(f'features: {n_samples} x {matrix.shape[1]}, fitted out of core')
+
+    features = np.empty((n_samples, n_components))
+    start = 0
+    for chunk in iter_chunks(dataset):
+        features[start:start + len(chunk)] = pca_in.transform(chunk)
+        start += len(chunk)
+    # same sign convention as in-memory pca, largest projection of each component positive
+    signs = np.sign(features[np.argmax(np.abs(features), axis=0), np.arange(n_components)])
+    features *= signs
+    return features, pca_in.explained_variance_ratio_
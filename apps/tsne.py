@@ -2,27 +2,35 @@
 # Year: 2021
 # Desc.: t-SNE application page
 
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 import dash_core_components as dcc
 import dash_html_components as html
-from sklearn.manifold import TSNE
 from apps import graph_settings                 # custom colors, layout, zoom and hiddne modebar
-import plotly.express as px
-import pandas as pd
+from apps import figures, sparse_data, decomposition, embeddings, neighbors
+from lazy import lazy
 from app import app
+import profiling
+import metrics
+import datastore
+import jobs
+import dash
+
+manifold = lazy('sklearn.manifold')
+px = lazy('plotly.express')
+
+# verbose t-SNE prints error every 50 iterations
+PROGRESS = r'\[t-SNE\] Iteration (?P<done>\d+):'
+# scikit-learn needs at least this many iterations
+MIN_ITERATIONS = 250
 
 
 layout = html.Div(
     [  # row-tsne
         html.Div(
             [
-                dcc.Loading(
-                    [
-                        dcc.Graph(id="graph_tsne")
-                    ],
-                    color='#00CC96',
-                    type='cube'
-                )
+                # computed in background job, progress is shown next to parameters
+                dcc.Graph(id="graph_tsne")
             ],
             className="pretty_container_left eleven columns"
         ),
@@ -67,6 +75,14 @@ layout = html.Div(
                     id='btn-tsne-reset',
                     n_clicks=0,
                     className='round-border btn-gradient'),
+                html.P(id='tsne-progress'),
+                html.Button(
+                    'Cancel',
+                    id='btn-tsne-cancel',
+                    n_clicks=0,
+                    className='round-border btn-gradient'),
+                dcc.Store(id='job-tsne'),
+                dcc.Interval(id='interval-tsne', interval=1000, disabled=True),
             ],
             className='pretty_container_right one column'
         )
@@ -108,60 +124,123 @@ def reset_tsne(in_n_clicks):
     return n_clicks, init, iterations, learning_rate, perplexity
 
 
+@profiling.profiled('tsne')
+def embed(dataset, cache_key, iterations, learning_rate, perplexity, init):
+    """
+    Fits t-SNE and caches embedding, runs in background job process.
+
+    :param dataset: handle of dataset stored on server
+    :param cache_key: key of embedding cache
+    :return: embedded samples
+    """
+    if neighbors.shared(dataset):
+        # neighbors searched once per dataset, perplexity changes only slice them
+        matrix = neighbors.tsne_distances(dataset, perplexity)
+        metric = 'precomputed'
+    else:
+        # sparse matrix without file column
+        matrix, filenames = sparse_data.load_matrix(dataset)
+        metric = 'euclidean'
+    if init == 'pca':
+        # t-SNE does not initialize sparse or precomputed input with pca itself
+        init = decomposition.decompose(dataset).features[:, :2]
+
+    # configure TSNE
+    tsne = manifold.TSNE(
+        n_components=2,
+        n_iter=iterations,
+        init=init,
+        random_state=1,
+        perplexity=perplexity,      # expected density
+        learning_rate=learning_rate,
+        metric=metric,
+        square_distances=True,      # precomputed distances are squared as euclidean ones
+        verbose=2,                  # progress of job is parsed from output
+    )
+    features = tsne.fit_transform(matrix)
+    embeddings.put(cache_key, features)
+    return features
+
+
 @app.callback(
+    Output('job-tsne', 'data'),
     [
-        Output('graph_tsne', 'figure'),  # plot t-SNE
-        Output('graph_tsne', 'config'),  # default zoom, hide modebar
-    ],
-    [
-        Input('table', 'derived_virtual_data'),  # get data from table
+        Input('dataset-view', 'data'),  # handle of filtered dataset stored on server
         Input('input-iterations', 'value'),
         Input('input-learning-rate', 'value'),
         Input('input-perplexity', 'value'),
         Input('dropdown-init', 'value'),
-    ]
+    ],
+    [State('job-tsne', 'data')]         # job replaced by this one
 )
-def update_tsne(rows,in_iterations,in_learning_rate,in_perplexity,in_init):
+def submit_tsne(dataset, in_iterations, in_learning_rate, in_perplexity, in_init, previous):
     """
 
-    :param rows: input data from dash_table.DataTable
+    :param dataset: handle of dataset stored on server
     :param in_iterations: input value
     :param in_learning_rate: input value
     :param in_perplexity: input value
     :param in_init: input value
-    :return: t-SNE graph
+    :param previous: job shown until now, cancelled when still running
+    :return: job computing t-SNE
     """
+    if dataset is None:
+        raise PreventUpdate
+    if in_iterations is None or in_learning_rate is None or in_perplexity is None \
+            or in_iterations < MIN_ITERATIONS or in_learning_rate <= 0 or in_perplexity <= 0:
+        # number is being typed, last valid job keeps running
+        return dash.no_update
 
-    print(f'updating tsne')
+    print(f'submitting tsne')
     print(f'iterations: {in_iterations}')
+    params = {
+        'iterations': in_iterations,
+        'learning_rate': in_learning_rate,
+        'perplexity': in_perplexity,
+        'init': in_init,
+    }
+    cache_key = embeddings.key('tsne', dataset, params)
+    if embeddings.cached(cache_key):
+        # repeated parameters are shown without job
+        job_id = None
+    else:
+        job_id = jobs.submit(
+            embed,
+            progress=PROGRESS,
+            total=in_iterations,
+            # header of request profiling the callback reaches job process this way
+            profile='tsne' if profiling.requested('tsne') else None,
+            dataset=dataset,
+            cache_key=cache_key,
+            **params
+        )
+    jobs.supersede(previous, job_id)
+    return {'id': job_id, 'key': cache_key, 'dataset': dataset}
 
-    # take data from cache files
-    df = pd.DataFrame(rows)
-    filenames = df['file']
-    # drop column files in case PDFs were loaded
-    # get values only
-    df = df.drop('file', axis=1)
-    print(f't-SNE input: {df}')
 
-    # configure TSNE
-    tsne = TSNE(
-        n_components=2,
-        n_iter=in_iterations,
-        init=in_init,
-        random_state=1,
-        perplexity=in_perplexity,      # expected density
-        learning_rate=in_learning_rate,
-    )
-    features = tsne.fit_transform(df)
+def figure(features, dataset) -> tuple:
+    """
+    Plots embedded samples colored by file.
+
+    :param features: embedded samples
+    :param dataset: handle of dataset stored on server
+    :return: t-SNE graph, its config
+    """
+    filenames = datastore.load_files(dataset)
     print(f't-SNE features: {features}')
-    fig_tsne = px.scatter(
-        features,
-        x=0,
-        y=1,
-        height=700,
-        color=filenames,
-        color_discrete_sequence=graph_settings.colors,
-    )
+    if figures.large(len(features)):
+        # one WebGL trace instead of one trace per file
+        fig_tsne = figures.scatter(features, filenames, labels=['', ''])
+        fig_tsne.update_layout(height=700)
+    else:
+        fig_tsne = px.scatter(
+            features,
+            x=0,
+            y=1,
+            height=700,
+            color=filenames,
+            color_discrete_sequence=graph_settings.colors,
+        )
 
     fig_tsne.update_layout(
         title='t-distributed Stochastic Neighbor Embedding',
@@ -175,3 +254,49 @@ def update_tsne(rows,in_iterations,in_learning_rate,in_perplexity,in_init):
     # fig_tsne.write_image("tsne.png")
 
     return fig_tsne, graph_settings.config
+
+
+@app.callback(
+    [
+        Output('graph_tsne', 'figure'),  # plot t-SNE
+        Output('graph_tsne', 'config'),  # default zoom, hide modebar
+        Output('tsne-progress', 'children'),
+        Output('interval-tsne', 'disabled'),
+    ],
+    [
+        Input('job-tsne', 'data'),
+        Input('interval-tsne', 'n_intervals'),
+        Input('btn-tsne-cancel', 'n_clicks'),
+    ]
+)
+@metrics.instrument('update_tsne')
+def update_tsne(job, n_intervals, cancel_clicks):
+    """
+
+    :param job: submitted job
+    :param n_intervals: polling of job status
+    :param cancel_clicks: cancel job
+    :return: t-SNE graph when job is done, job progress, stop polling
+    """
+    if job is None:
+        raise PreventUpdate
+
+    if job['id'] is None:
+        features = embeddings.get(job['key'])
+        if features is None:
+            return dash.no_update, dash.no_update, 'cached embedding was evicted', True
+        return figure(features, job['dataset']) + ('cached', True)
+
+    trigger = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
+    if trigger == 'btn-tsne-cancel':
+        jobs.cancel(job['id'])
+    status = jobs.status(job['id'])
+    if status is None:
+        return dash.no_update, dash.no_update, 'job not found', True
+    if status['state'] in ['failed', 'cancelled']:
+        return dash.no_update, dash.no_update, f'{status["state"]}: {status["message"]}', True
+    if status['state'] != 'done':
+        return dash.no_update, dash.no_update, f'{status["state"]}: {status["message"]}', False
+
+    features = jobs.result(job['id'])
+    return figure(features, job['dataset']) + (f'done in {status["finished"] - status["started"]:.1f} s', True)
@@ -2,26 +2,35 @@
 # Year: 2021
 # Desc.: UMAP application page
 
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 import dash_core_components as dcc
 import dash_html_components as html
 from apps import graph_settings # custom colors, layout, zoom and hidden modebar
-import plotly.express as px
-import pandas as pd
+from apps import figures, sparse_data, embeddings, neighbors, placement
+from lazy import lazy
 from app import app
-import umap
+import profiling
+import metrics
+import datastore
+import jobs
+import dash
+
+px = lazy('plotly.express')
+umap = lazy('umap')
+
+# verbose UMAP prints optimized epochs, '  completed 50 / 500 epochs' or tqdm bar 'Epochs completed: ... 50/500'
+PROGRESS = r'(?:completed|Epochs completed:[^\r\n]*?)\s*(?P<done>\d+)\s*/\s*(?P<total>\d+)'
+# accepted parameters, as in placeholders of inputs
+MIN_DIST_RANGE = (0, 0.99)
+NEIGHBORS_RANGE = (2, 200)
 
 layout = html.Div(
     [  # row-umap
         html.Div(
             [
-                dcc.Loading(
-                    [
-                        dcc.Graph(id="graph_umap")
-                    ],
-                    color='#00CC96',
-                    type='cube'
-                )
+                # computed in background job, progress is shown next to parameters
+                dcc.Graph(id="graph_umap")
             ],
             className="pretty_container_left eleven columns"
         ),
@@ -72,6 +81,26 @@ layout = html.Div(
                     id='btn-umap-reset',
                     n_clicks=0,
                     className='round-border btn-gradient'),
+                dcc.Checklist(
+                    id='check-umap-stable',
+                    options=[
+                        {'label': 'Keep map', 'value': 'stable'},
+                    ],
+                    value=['stable'],
+                ),
+                html.Button(
+                    'Refit',
+                    id='btn-umap-refit',
+                    n_clicks=0,
+                    className='round-border btn-gradient'),
+                html.P(id='umap-progress'),
+                html.Button(
+                    'Cancel',
+                    id='btn-umap-cancel',
+                    n_clicks=0,
+                    className='round-border btn-gradient'),
+                dcc.Store(id='job-umap'),
+                dcc.Interval(id='interval-umap', interval=1000, disabled=True),
             ],
             className='pretty_container_right one column'
         )
@@ -114,57 +143,149 @@ def reset_umap(in_n_clicks):  # every callback needs at least one Input, its nee
     return n_clicks, init, metric, min_dist, n_neighbors
 
 
+@profiling.profiled('umap')
+def embed(dataset, cache_key, init, metric, min_dist, n_neighbors, keep_model=False):
+    """
+    Fits UMAP and caches embedding, runs in background job process.
+
+    :param dataset: handle of dataset stored on server
+    :param cache_key: key of embedding cache
+    :param keep_model: store fitted model as current map of session, see placement.py
+    :return: embedded samples
+    """
+    # sparse matrix without file column
+    matrix, filenames = sparse_data.load_matrix(dataset)
+    # dense like matrix of shared neighbors index, stored models then transform dense rows
+    matrix = matrix.toarray()
+    precomputed_knn = (None, None, None)
+    if neighbors.shared(dataset):
+        # neighbors searched once per dataset and metric, n_neighbors changes only slice them
+        precomputed_knn = neighbors.umap_knn(dataset, metric, n_neighbors)
+
+    umap_2d = umap.UMAP(
+        n_components=2,
+        init=init,
+        random_state=1,
+        min_dist=min_dist,
+        n_neighbors=n_neighbors,
+        metric=metric,
+        precomputed_knn=precomputed_knn,
+        verbose=True,           # progress of job is parsed from output
+    )
+    features = umap_2d.fit_transform(matrix)
+    embeddings.put(cache_key, features)
+    if keep_model:
+        params = {'init': init, 'metric': metric, 'min_dist': min_dist, 'n_neighbors': n_neighbors}
+        placement.save_model(dataset, params, cache_key, umap_2d, features)
+    return features
+
+
 @app.callback(
+    Output('job-umap', 'data'),
     [
-        Output('graph_umap', 'figure'),  # plot t-SNE
-        Output('graph_umap', 'config'),  # default zoom, hide modebar
-    ],
-    [
-        Input('table', 'derived_virtual_data'),  # get data from table
+        Input('dataset-view', 'data'),  # handle of filtered dataset stored on server
         Input('dropdown-umap-init', 'value'),
         Input('dropdown-metric', 'value'),
         Input('input-min-dist', 'value'),
         Input('input-neighbors', 'value'),
-    ]
+        Input('check-umap-stable', 'value'),     # place appended samples into fitted map
+        Input('btn-umap-refit', 'n_clicks'),     # fit map again on current dataset
+    ],
+    [State('job-umap', 'data')]                 # job replaced by this one
 )
-def update_umap(rows, in_init, in_metric, in_dist, in_neighbor):
+def submit_umap(dataset, in_init, in_metric, in_dist, in_neighbor, in_stable, refit_clicks, previous):
     """
 
-    :param rows: input data from dash_table.DataTable
+    :param dataset: handle of dataset stored on server
     :param in_init: input value
     :param in_metric: input value
     :param in_dist: input value
     :param in_neighbor: input value
-    :return: UMAP graph
+    :param in_stable: ['stable'] to keep map stable
+    :param refit_clicks: refit map
+    :param previous: job shown until now, cancelled when still running
+    :return: job computing UMAP, or cached embedding
     """
+    if dataset is None:
+        raise PreventUpdate
+    if in_dist is None or in_neighbor is None or not MIN_DIST_RANGE[0] <= in_dist <= MIN_DIST_RANGE[1] \
+            or not NEIGHBORS_RANGE[0] <= in_neighbor <= NEIGHBORS_RANGE[1]:
+        # number is being typed, last valid job keeps running
+        return dash.no_update
+    job = umap_job(dataset, in_init, in_metric, in_dist, in_neighbor, in_stable)
+    jobs.supersede(previous, job['id'])
+    return job
 
-    print(f'updating umap')
-    # take data from cache files
-    df = pd.DataFrame(rows)
-    filenames = df['file']
-    # drop column files in case PDFs were loaded
-    # get values only
-    df = df.drop('file', axis=1)
-    print(f'umap input: {df}')
 
-    umap_2d = umap.UMAP(
-        n_components=2,
-        init=in_init,
-        random_state=1,
-        min_dist=in_dist,
-        n_neighbors=in_neighbor,
-        metric=in_metric
+def umap_job(dataset, in_init, in_metric, in_dist, in_neighbor, in_stable) -> dict:
+    """
+    Finds UMAP of dataset in cache or current map, submits job computing it otherwise.
+
+    :return: job store data {'id': job id or None, 'key': embedding key, 'dataset': handle}
+    """
+    print(f'submitting umap')
+    params = {
+        'init': in_init,
+        'metric': in_metric,
+        'min_dist': in_dist,
+        'n_neighbors': in_neighbor,
+    }
+    cache_key = embeddings.key('umap', dataset, params)
+    stable = 'stable' in (in_stable or [])
+    trigger = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
+
+    fit_key = placement.current(dataset, params) if stable and trigger != 'btn-umap-refit' else None
+    if fit_key is not None and fit_key != cache_key:
+        # appended or filtered samples are placed into current map, no refit
+        placed_key = embeddings.key('umap', dataset, dict(params, placed_on=fit_key))
+        if embeddings.cached(placed_key):
+            return {'id': None, 'key': placed_key, 'dataset': dataset}
+        features = placement.place(dataset, fit_key)
+        if features is not None:
+            embeddings.put(placed_key, features)
+            return {'id': None, 'key': placed_key, 'dataset': dataset}
+
+    if embeddings.cached(cache_key) and (not stable or placement.has_model(dataset, cache_key)):
+        # repeated parameters are shown without job
+        if stable:
+            placement.set_current(dataset, params, cache_key)
+        return {'id': None, 'key': cache_key, 'dataset': dataset}
+    job_id = jobs.submit(
+        embed,
+        progress=PROGRESS,
+        # header of request profiling the callback reaches job process this way
+        profile='umap' if profiling.requested('umap') else None,
+        dataset=dataset,
+        cache_key=cache_key,
+        keep_model=stable,
+        **params
     )
-    features = umap_2d.fit_transform(df)
+    return {'id': job_id, 'key': cache_key, 'dataset': dataset}
+
+
+def figure(features, dataset) -> tuple:
+    """
+    Plots embedded samples colored by file.
+
+    :param features: embedded samples
+    :param dataset: handle of dataset stored on server
+    :return: UMAP graph, its config
+    """
+    filenames = datastore.load_files(dataset)
     print(f'umap features: {features}')
-    fig_umap = px.scatter(
-        features,
-        x=0,
-        y=1,
-        height=700,
-        color=filenames,
-        color_discrete_sequence = graph_settings.colors,
-    )
+    if figures.large(len(features)):
+        # one WebGL trace instead of one trace per file
+        fig_umap = figures.scatter(features, filenames, labels=['', ''])
+        fig_umap.update_layout(height=700)
+    else:
+        fig_umap = px.scatter(
+            features,
+            x=0,
+            y=1,
+            height=700,
+            color=filenames,
+            color_discrete_sequence = graph_settings.colors,
+        )
     fig_umap.update_layout(
         title='Uniform Manifold Approximation and Projection',
         title_x=0.5,                                                # center title
@@ -176,3 +297,49 @@ def update_umap(rows, in_init, in_metric, in_dist, in_neighbor):
     )
     # fig_umap.write_image("umap.pdf")
     return fig_umap, graph_settings.config
+
+
+@app.callback(
+    [
+        Output('graph_umap', 'figure'),  # plot UMAP
+        Output('graph_umap', 'config'),  # default zoom, hide modebar
+        Output('umap-progress', 'children'),
+        Output('interval-umap', 'disabled'),
+    ],
+    [
+        Input('job-umap', 'data'),
+        Input('interval-umap', 'n_intervals'),
+        Input('btn-umap-cancel', 'n_clicks'),
+    ]
+)
+@metrics.instrument('update_umap')
+def update_umap(job, n_intervals, cancel_clicks):
+    """
+
+    :param job: submitted job
+    :param n_intervals: polling of job status
+    :param cancel_clicks: cancel job
+    :return: UMAP graph when job is done, job progress, stop polling
+    """
+    if job is None:
+        raise PreventUpdate
+
+    if job['id'] is None:
+        features = embeddings.get(job['key'])
+        if features is None:
+            return dash.no_update, dash.no_update, 'cached embedding was evicted', True
+        return figure(features, job['dataset']) + ('cached', True)
+
+    trigger = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
+    if trigger == 'btn-umap-cancel':
+        jobs.cancel(job['id'])
+    status = jobs.status(job['id'])
+    if status is None:
+        return dash.no_update, dash.no_update, 'job not found', True
+    if status['state'] in ['failed', 'cancelled']:
+        return dash.no_update, dash.no_update, f'{status["state"]}: {status["message"]}', True
+    if status['state'] != 'done':
+        return dash.no_update, dash.no_update, f'{status["state"]}: {status["message"]}', False
+
+    features = jobs.result(job['id'])
+    return figure(features, job['dataset']) + (f'done in {status["finished"] - status["started"]:.1f} s', True)
@@ -0,0 +1,120 @@
+// Author: libor@labavit.com
+// Year: 2021
+// Desc.: Streams dropped or selected files to /upload and passes file ids to Dash
+
+(function () {
+    // files sent at the same time
+    var PARALLEL_UPLOADS = 4;
+    var ACCEPTED_TYPES = '.pdf,.csv,.xlsx';
+    var fileInput = null;
+
+    function getFileInput() {
+        // hidden file dialog, created once outside of Dash layout
+        if (fileInput === null) {
+            fileInput = document.createElement('input');
+            fileInput.type = 'file';
+            fileInput.multiple = true;
+            fileInput.accept = ACCEPTED_TYPES;
+            fileInput.style.display = 'none';
+            fileInput.addEventListener('change', function () {
+                uploadFiles(fileInput.files);
+                fileInput.value = '';
+            });
+            document.body.appendChild(fileInput);
+        }
+        return fileInput;
+    }
+
+    function uploadFile(file) {
+        // request body is the file itself, browser streams it without base64
+        return fetch('/upload?name=' + encodeURIComponent(file.name), {
+            method: 'POST',
+            body: file
+        }).then(function (response) {
+            return response.json().then(function (result) {
+                if (!response.ok) {
+                    throw new Error(result.error);
+                }
+                return result;
+            });
+        });
+    }
+
+    function setStatus(text) {
+        var status = document.getElementById('upload-status');
+        if (status) {
+            status.textContent = text;
+        }
+    }
+
+    function passToDash(ids) {
+        // dcc.Input is React component, value has to be set through native setter
+        var input = document.getElementById('upload-ids');
+        var setter = Object.getOwnPropertyDescriptor(window.HTMLInputElement.prototype, 'value').set;
+        // time makes every upload a change, even of the same files
+        setter.call(input, JSON.stringify({ids: ids, time: Date.now()}));
+        input.dispatchEvent(new Event('input', {bubbles: true}));
+    }
+
+    function uploadFiles(files) {
+        files = Array.prototype.slice.call(files);
+        if (files.length === 0) {
+            return;
+        }
+        var ids = new Array(files.length);
+        var next = 0;
+        var done = 0;
+
+        function worker() {
+            if (next >= files.length) {
+                return Promise.resolve();
+            }
+            var index = next++;
+            return uploadFile(files[index]).then(function (result) {
+                // keep order of selected files
+                ids[index] = result.id;
+                done++;
+                setStatus('Uploaded ' + done + ' / ' + files.length + ' files');
+                return worker();
+            });
+        }
+
+        var workers = [];
+        for (var i = 0; i < Math.min(PARALLEL_UPLOADS, files.length); i++) {
+            workers.push(worker());
+        }
+        Promise.all(workers).then(function () {
+            passToDash(ids);
+        }).catch(function (error) {
+            setStatus('Upload failed: ' + error.message);
+        });
+    }
+
+    // page content is rendered by Dash later, events are handled on document
+    document.addEventListener('click', function (event) {
+        if (event.target.closest && event.target.closest('#upload-data')) {
+            getFileInput().click();
+        }
+    });
+    document.addEventListener('dragover', function (event) {
+        var zone = event.target.closest && event.target.closest('#upload-data');
+        if (zone) {
+            event.preventDefault();
+            zone.classList.add('upload-active');
+        }
+    });
+    document.addEventListener('dragleave', function (event) {
+        var zone = event.target.closest && event.target.closest('#upload-data');
+        if (zone) {
+            zone.classList.remove('upload-active');
+        }
+    });
+    document.addEventListener('drop', function (event) {
+        var zone = event.target.closest && event.target.closest('#upload-data');
+        if (zone) {
+            event.preventDefault();
+            zone.classList.remove('upload-active');
+            uploadFiles(event.dataTransfer.files);
+        }
+    });
+})();
@@ -0,0 +1,62 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Compares extraction of short and long Shimadzu reports
+#
+# Usage: python -m benchmarks.bench_pages [-n 2] [--pages 1 20] [-w 4]
+
+import argparse
+import time
+import os
+
+from benchmarks import synthetic
+import parser
+
+
+def arg_parser() -> argparse.Namespace:
+    arguments = argparse.ArgumentParser(description='Times extraction of 1-page and multi-page Shimadzu reports')
+    arguments.add_argument('-d', '--data', default='bench_data', help='directory of generated reports')
+    arguments.add_argument('-n', '--reports', type=int, default=2, help='reports of every length')
+    arguments.add_argument('--pages', type=int, nargs='+', default=[1, 20], help='compared report lengths')
+    arguments.add_argument('--peaks', type=int, default=40, help='peaks per page')
+    arguments.add_argument('-w', '--workers', type=int, default=parser.EXTRACT_WORKERS, help='extraction processes')
+    arguments.add_argument('-r', '--repeat', type=int, default=3, help='runs of every case, best is reported')
+    return arguments.parse_args()
+
+
+def open_files() -> int:
+    # descriptors of this process, -1 where /proc is missing
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except FileNotFoundError:
+        return -1
+
+
+def bench(files, workers, repeat) -> (float, int, int):
+    """
+    Times extraction of all pages bypassing extraction cache.
+
+    :param files: list of file paths
+    :param workers: extraction processes, see parser.iter_shimadzu
+    :param repeat: number of runs
+    :return: best time, number of extracted peaks, descriptors left open by extraction
+    """
+    best, peaks, leaked = float('inf'), 0, 0
+    for _ in range(repeat):
+        before = open_files()
+        start = time.perf_counter()
+        peaks = sum(len(df) for _, df in parser.iter_shimadzu(files, workers))
+        best = min(best, time.perf_counter() - start)
+        leaked = max(leaked, open_files() - before)
+    return best, peaks, leaked
+
+
+if __name__ == '__main__':
+    args = arg_parser()
+    print(f'{"pages":>6}{"workers":>9}{"total [s]":>12}{"per page [ms]":>15}{"peaks":>8}{"expected":>10}{"open files":>12}')
+    for pages in args.pages:
+        n_peaks = args.peaks * pages
+        files = synthetic.reports(args.data, args.reports, n_peaks, pages)
+        for workers in sorted({1, args.workers}):
+            total, peaks, leaked = bench(files, workers, args.repeat)
+            per_page = 1000 * total / (pages * len(files))
+            print(f'{pages:>6}{workers:>9}{total:>12.3f}{per_page:>15.1f}{peaks:>8}{n_peaks * len(files):>10}{leaked:>+12}')
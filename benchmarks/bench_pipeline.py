@@ -0,0 +1,199 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Times every stage from PDF reports to t-SNE and UMAP on synthetic data
+#
+# Usage: python -m benchmarks.bench_pipeline [-n 200] [-o results.json] [-b baseline.json | --save-baseline baseline.json]
+
+import argparse
+import platform
+import tempfile
+import json
+import time
+import uuid
+import sys
+import os
+
+import pandas as pd
+
+from benchmarks import synthetic
+from binning import RetentionBinner
+from dataset import Dataset
+from cache import NpzCache
+from lazy import lazy
+import datastore
+import parser
+from apps import decomposition, clustering, embeddings, tsne, umap
+
+ff = lazy('plotly.figure_factory')
+plotly_utils = lazy('plotly.utils')
+
+# rows sent with the first table page, as in index.py
+PAGE_SIZE = 20
+# stage is a regression when slower than baseline by this fraction and by MIN_DELTA seconds
+TOLERANCE = 0.25
+MIN_DELTA = 0.05
+STAGES = ['extract', 'binning', 'serialize', 'pca_elbow', 'dendrogram', 'tsne', 'umap', 'csv', 'xlsx']
+
+
+def arg_parser() -> argparse.Namespace:
+    arguments = argparse.ArgumentParser(description='Times pipeline stages on synthetic reports and datasets')
+    arguments.add_argument('-d', '--data', default='bench_data', help='directory of generated input files')
+    arguments.add_argument('-n', '--reports', type=int, default=200, help='number of PDF reports')
+    arguments.add_argument('--peaks', type=int, default=40, help='peaks per report')
+    arguments.add_argument('--rows', type=int, default=1000, help='rows of numeric datasets')
+    arguments.add_argument('--columns', type=int, default=50, help='columns of numeric datasets')
+    arguments.add_argument('-w', '--workers', type=int, default=1, help='extraction processes, 1 runs serially')
+    arguments.add_argument('--tsne-iterations', type=int, default=1000, help='t-SNE iterations')
+    arguments.add_argument('-s', '--stage', nargs='+', choices=STAGES, default=STAGES, help='timed stages')
+    arguments.add_argument('-r', '--repeat', type=int, default=1, help='runs of the pipeline, best is reported')
+    arguments.add_argument('-o', '--output', help='write results as json')
+    arguments.add_argument('-b', '--baseline', help='compare with results json, exits with 1 on regression')
+    arguments.add_argument('-t', '--tolerance', type=float, default=TOLERANCE, help='allowed slowdown fraction')
+    arguments.add_argument('--save-baseline', metavar='PATH', help='write results as new baseline json')
+    return arguments.parse_args()
+
+
+def workspace(directory):
+    """
+    Points dataset store and embedding cache into empty directory, so every run starts cold.
+
+    :param directory: temporary directory
+    """
+    datastore.STORE_DIRECTORY = os.path.join(directory, 'datasets')
+    embeddings.EMBEDDING_CACHE = NpzCache(os.path.join(directory, 'embeddings'))
+    # in-memory caches of this worker
+    for memory in [datastore._datasets, datastore._views, decomposition._decompositions, clustering._elbows]:
+        memory.clear()
+
+
+def save_table(session, file, read) -> dict:
+    # as index.parse_contents reads uploaded table and files2table stores it
+    return datastore.save(session, Dataset.from_frame(read(file).assign(file=file)))
+
+
+def run(files, stages, workers, tsne_iterations) -> dict:
+    """
+    Runs stages once, each stage gets output of previous ones.
+
+    :param files: generated files, see synthetic.generate
+    :param stages: names of timed stages, stages they depend on run untimed
+    :param workers: extraction processes
+    :param tsne_iterations: t-SNE iterations
+    :return: dictionary {'stage': seconds}
+    """
+    times = {}
+    session = uuid.uuid4().hex
+
+    def timed(stage, function):
+        start = time.perf_counter()
+        result = function()
+        if stage in stages:
+            times[stage] = time.perf_counter() - start
+        return result
+
+    reports = files['reports']
+    analysis = {'pca_elbow', 'dendrogram', 'tsne', 'umap'} & set(stages)
+    if analysis or {'extract', 'binning', 'serialize'} & set(stages):
+        # extraction cache is bypassed, every run parses all reports
+        tables = timed('extract', lambda: [df for _, df in parser.iter_shimadzu(reports, workers)])
+
+        def binning():
+            peaks = pd.concat([df.assign(file=file) for file, df in zip(reports, tables)])
+            binner = RetentionBinner()
+            binner.add(peaks['file'], peaks['Ret. Time'], peaks[parser.SHIMADZU_COLUMNS])
+            return binner.to_frame(reports)
+        df = timed('binning', binning)
+
+        def serialize():
+            dataset = datastore.save(session, Dataset.from_frame(df))
+            json.dumps(datastore.page(dataset, 0, PAGE_SIZE), cls=plotly_utils.PlotlyJSONEncoder)
+            return dataset
+        dataset = timed('serialize', serialize)
+
+    if analysis:
+        if 'pca_elbow' in stages:
+            timed('pca_elbow', lambda: clustering.elbow(dataset, 2))
+        if 'dendrogram' in stages:
+            timed('dendrogram', lambda: ff.create_dendrogram(decomposition.decompose(dataset).features[:, :2]).to_json())
+        if 'tsne' in stages:
+            params = dict(iterations=tsne_iterations, learning_rate=200, perplexity=30, init='pca')
+            key = embeddings.key('tsne', dataset, params)
+            timed('tsne', lambda: tsne.embed(dataset, key, **params))
+        if 'umap' in stages:
+            params = dict(init='spectral', metric='euclidean', min_dist=0.1, n_neighbors=15)
+            key = embeddings.key('umap', dataset, params)
+            timed('umap', lambda: umap.embed(dataset, key, **params))
+
+    if 'csv' in stages:
+        timed('csv', lambda: save_table(session, files['csv'], pd.read_csv))
+    if 'xlsx' in stages:
+        timed('xlsx', lambda: save_table(session, files['xlsx'], pd.read_excel))
+    return times
+
+
+def bench(files, stages, workers, tsne_iterations, repeat) -> dict:
+    """
+    Runs pipeline repeatedly in fresh workspace.
+
+    :return: dictionary {'stage': best seconds}
+    """
+    best = {}
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as directory:
+            workspace(directory)
+            for stage, seconds in run(files, stages, workers, tsne_iterations).items():
+                best[stage] = min(best.get(stage, float('inf')), seconds)
+    return best
+
+
+def regressions(results, baseline, tolerance) -> list:
+    """
+    Compares stage times with baseline.
+
+    :param results: results json of this run
+    :param baseline: results json of baseline run
+    :param tolerance: allowed slowdown fraction
+    :return: list of messages, empty when no stage got slower
+    """
+    if results['params'] != baseline['params']:
+        return [f'baseline was measured with other parameters: {baseline["params"]}']
+    messages = []
+    for stage, seconds in results['stages'].items():
+        before = baseline['stages'].get(stage)
+        if before is None:
+            continue
+        if seconds > before * (1 + tolerance) and seconds - before > MIN_DELTA:
+            messages.append(f'{stage}: {seconds:.3f} s, baseline {before:.3f} s, {100 * (seconds / before - 1):+.0f} %')
+    return messages
+
+
+if __name__ == '__main__':
+    args = arg_parser()
+    input_files = synthetic.generate(args.data, args.reports, args.peaks, args.rows, args.columns)
+    params = {
+        'reports': args.reports, 'peaks': args.peaks, 'rows': args.rows, 'columns': args.columns,
+        'workers': args.workers, 'tsne_iterations': args.tsne_iterations,
+    }
+    stages = bench(input_files, args.stage, args.workers, args.tsne_iterations, args.repeat)
+    results = {
+        'params': params,
+        'environment': {'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'stages': stages,
+    }
+    print(f'{len(input_files["reports"])} reports, {args.rows} x {args.columns} numeric table')
+    for stage, seconds in stages.items():
+        print(f'{stage:<12}{seconds:>9.3f} s')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'baseline saved to {args.save_baseline}')
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = regressions(results, json.load(f), args.tolerance)
+        if failures:
+            sys.exit('regression against {}:\n{}'.format(args.baseline, '\n'.join(failures)))
+        print(f'no regression against {args.baseline}')
@@ -0,0 +1,50 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Compares SPECORD extraction engines
+#
+# Usage: python -m benchmarks.bench_spectrals -f realdata/specord/*.pdf
+
+import argparse
+import time
+
+import parser
+
+
+def arg_parser() -> argparse.Namespace:
+    arguments = argparse.ArgumentParser(description='Times SPECORD extraction engines on the same files')
+    arguments.add_argument('-f', '--file', required=True, help='SPECORD PDF files', nargs='+')
+    arguments.add_argument('-e', '--engine', help='engines to compare', nargs='+',
+                           default=['tabula', 'tabula-batch', 'pdfplumber'])
+    arguments.add_argument('-r', '--repeat', help='runs of every engine, best is reported', type=int, default=3)
+    return arguments.parse_args()
+
+
+def bench(files, engine, repeat) -> (float, float, int):
+    """
+    Times extraction bypassing extraction cache.
+
+    :param files: list of file paths
+    :param engine: see parser.iter_spectrals
+    :param repeat: number of runs
+    :return: best total time, time to the first file, number of extracted numbers
+    """
+    best_total, best_first, numbers = float('inf'), float('inf'), 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        first = None
+        numbers = 0
+        for file, df in parser.iter_spectrals(files, engine, workers=1):
+            if first is None:
+                first = time.perf_counter() - start
+            numbers += int(df.count().sum())
+        best_total = min(best_total, time.perf_counter() - start)
+        best_first = min(best_first, first)
+    return best_total, best_first, numbers
+
+
+if __name__ == '__main__':
+    args = arg_parser()
+    print(f'{"engine":<14}{"total [s]":>12}{"per file [s]":>14}{"first file [s]":>16}{"numbers":>10}')
+    for engine in args.engine:
+        total, first, numbers = bench(args.file, engine, args.repeat)
+        print(f'{engine:<14}{total:>12.3f}{total / len(args.file):>14.3f}{first:>16.3f}{numbers:>10}')
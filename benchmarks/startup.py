@@ -0,0 +1,53 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Import cost per module at worker startup
+#
+# Usage: python -m benchmarks.startup [-m index] [-n 25]
+
+import subprocess
+import argparse
+import json
+import sys
+import re
+
+
+def arg_parser() -> argparse.Namespace:
+    arguments = argparse.ArgumentParser(description='Reports import time of every package loaded at startup')
+    arguments.add_argument('-m', '--module', default='index', help='imported module, index is what gunicorn loads')
+    arguments.add_argument('-n', '--top', type=int, default=25, help='number of reported packages')
+    arguments.add_argument('-o', '--output', help='write report as json')
+    return arguments.parse_args()
+
+
+def import_times(module) -> dict:
+    """
+    Imports module in fresh interpreter with -X importtime.
+
+    :param module: module name
+    :return: dictionary {'top level package': self import time in seconds}
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True
+    )
+    packages = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        match = re.match(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(\S+)', line.strip())
+        if match is None:
+            continue
+        package = match.group(3).split('.')[0]
+        packages[package] = packages.get(package, 0) + int(match.group(1)) / 1e6
+    return packages
+
+
+if __name__ == '__main__':
+    args = arg_parser()
+    packages = import_times(args.module)
+    total = sum(packages.values())
+    print(f'importing {args.module}: {total:.2f} s, {len(packages)} top level packages')
+    for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f'{package:<30}{seconds:>8.3f} s{100 * seconds / total:>7.1f} %')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'module': args.module, 'total': total, 'packages': packages}, f, indent=2)
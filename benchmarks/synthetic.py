@@ -0,0 +1,224 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Synthetic Shimadzu reports and numeric datasets for benchmarks
+#
+# Usage: python -m benchmarks.synthetic -o bench_data -n 200 [--peaks 40] [--pages 1] [--rows 1000 --columns 50]
+
+import argparse
+import os
+
+import pandas as pd
+import numpy as np
+
+# compounds shared by all samples, their retention times in minutes
+N_COMPOUNDS = 80
+RETENTION_RANGE = (0.5, 30.0)
+# samples fall into groups with different compound profiles, so PCA and k-means have something to find
+N_GROUPS = 3
+# table geometry in points, A4 page
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+TABLE_TOP = 760
+ROW_HEIGHT = 12
+COLUMN_EDGES = [50, 100, 190, 290, 390, 470]
+HEADER = ['Peak#', 'Ret. Time', 'Area', 'Height', 'Area%']
+
+
+def escape(text) -> str:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def text(x, y, value, size=9) -> str:
+    return f'BT /F1 {size} Tf {x} {y} Td ({escape(value)}) Tj ET'
+
+
+def pdf(contents) -> bytes:
+    """
+    Writes minimal PDF, one uncompressed content stream per page, Helvetica font.
+
+    :param contents: list of page content streams
+    :return: PDF file content
+    """
+    n_pages = len(contents)
+    page_ids = [4 + 2 * i for i in range(n_pages)]
+    objects = [
+        '<< /Type /Catalog /Pages 2 0 R >>',
+        f'<< /Type /Pages /Kids [{" ".join(f"{i} 0 R" for i in page_ids)}] /Count {n_pages} >>',
+        '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+    ]
+    for page_id, content in zip(page_ids, contents):
+        objects.append(
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+            f'/Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>'
+        )
+        stream = content.encode('latin-1')
+        objects.append(f'<< /Length {len(stream)} >>\nstream\n{content}\nendstream')
+
+    data = b'%PDF-1.4\n'
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += f'{number} 0 obj\n{body}\nendobj\n'.encode('latin-1')
+    xref = len(data)
+    data += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode('latin-1')
+    data += ''.join(f'{offset:010d} 00000 n \n' for offset in offsets).encode('latin-1')
+    data += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode('latin-1')
+    return data
+
+
+def table(rows, top=TABLE_TOP) -> str:
+    """
+    Draws table ruled by lines, as pdfplumber finds tables of Shimadzu reports.
+
+    :param rows: list of rows, list of cell strings
+    :param top: y of upper table edge
+    :return: content stream operators
+    """
+    bottom = top - ROW_HEIGHT * len(rows)
+    operators = ['0.5 w']
+    for i in range(len(rows) + 1):
+        y = top - ROW_HEIGHT * i
+        operators.append(f'{COLUMN_EDGES[0]} {y} m {COLUMN_EDGES[-1]} {y} l S')
+    for x in COLUMN_EDGES:
+        operators.append(f'{x} {top} m {x} {bottom} l S')
+    for i, row in enumerate(rows):
+        y = top - ROW_HEIGHT * (i + 1) + 3
+        for x, cell in zip(COLUMN_EDGES, row):
+            if cell:
+                operators.append(text(x + 3, y, cell))
+    return '\n'.join(operators)
+
+
+def peaks(seed, n_peaks) -> pd.DataFrame:
+    """
+    Random peak table of one sample.
+
+    :param seed: sample number, same seed gives same peaks
+    :param n_peaks: number of peaks, peaks above N_COMPOUNDS are small noise peaks
+    :return: dataframe with 'Ret. Time', 'Area', 'Height' and 'Area%' columns
+    """
+    compounds = np.random.RandomState(0)
+    retention_times = np.sort(compounds.uniform(*RETENTION_RANGE, N_COMPOUNDS))
+    profiles = compounds.lognormal(10, 1, (N_GROUPS, N_COMPOUNDS))
+
+    sample = np.random.RandomState(seed + 1)
+    chosen = np.sort(sample.choice(N_COMPOUNDS, min(n_peaks, N_COMPOUNDS), replace=False))
+    area = np.rint(profiles[seed % N_GROUPS, chosen] * sample.lognormal(0, 0.2, len(chosen))).astype(int)
+    retention = retention_times[chosen] + sample.normal(0, 0.005, len(chosen))
+    if n_peaks > N_COMPOUNDS:
+        # long runs, many small peaks between compounds
+        noise = n_peaks - N_COMPOUNDS
+        retention = np.concatenate([retention, sample.uniform(*RETENTION_RANGE, noise)])
+        area = np.concatenate([area, np.rint(sample.lognormal(6, 1, noise)).astype(int)])
+        order = np.argsort(retention, kind='stable')
+        retention, area = retention[order], area[order]
+    return pd.DataFrame({
+        'Ret. Time': retention,
+        'Area': area,
+        'Height': area // 20,
+        'Area%': 100 * area / area.sum(),
+    })
+
+
+def shimadzu_report(path, seed, n_peaks=40, pages=1):
+    """
+    Writes one synthetic Shimadzu chromatogram report.
+
+    Peak table has title and detector rows, header in third row and 'Total' row at the end,
+    like reports read by parser.extract_shimadzu_table.
+    Peaks of long runs continue on next pages without header, 'Total' row is on the last page.
+
+    :param path: output PDF path
+    :param seed: sample number
+    :param n_peaks: number of peaks, about 55 rows fit on one page
+    :param pages: number of pages the peak table is split into
+    """
+    df = peaks(seed, n_peaks)
+    rows = []
+    for number, peak in enumerate(df.itertuples(index=False), start=1):
+        rows.append([str(number), f'{peak[0]:.3f}', str(peak[1]), str(peak[2]), f'{peak[3]:.4f}'])
+    page_rows = [[rows[i] for i in part] for part in np.array_split(np.arange(len(rows)), pages)]
+    page_rows[0] = [['Peak Table'], ['Detector A Ch1 254nm'], HEADER] + page_rows[0]
+    page_rows[-1].append(['Total', '', str(df['Area'].sum()), str(df['Height'].sum()), '100.0000'])
+
+    contents = []
+    for number, part in enumerate(page_rows, start=1):
+        header = [
+            text(COLUMN_EDGES[0], 800, 'Chromatogram Report', size=14),
+            text(COLUMN_EDGES[0], 785, f'Sample Name: sample_{seed:05d}'),
+        ]
+        if pages > 1:
+            header.append(text(COLUMN_EDGES[-1], 785, f'Page {number}/{pages}'))
+        contents.append('\n'.join(header + [table(part)]))
+    with open(path, 'wb') as f:
+        f.write(pdf(contents))
+
+
+def reports(directory, n_reports, n_peaks=40, pages=1) -> list:
+    """
+    Writes Shimadzu reports into directory, existing files are kept.
+
+    :return: list of PDF paths
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for seed in range(n_reports):
+        suffix = '' if pages == 1 else f'_{pages}p'
+        path = os.path.join(directory, f'report_{seed:05d}_{n_peaks}{suffix}.pdf')
+        if not os.path.exists(path):
+            shimadzu_report(path, seed, n_peaks, pages)
+        paths.append(path)
+    return paths
+
+
+def numeric_frame(n_rows, n_columns, seed=0) -> pd.DataFrame:
+    """
+    Numeric dataset with groups of rows, like xlsx and csv samples.
+
+    :param n_rows: number of rows
+    :param n_columns: number of numeric columns
+    :param seed: random seed
+    :return: dataframe
+    """
+    state = np.random.RandomState(seed)
+    centers = state.normal(0, 5, (N_GROUPS, n_columns))
+    values = centers[np.arange(n_rows) % N_GROUPS] + state.normal(0, 1, (n_rows, n_columns))
+    return pd.DataFrame(values, columns=[f'x{i}' for i in range(n_columns)])
+
+
+def generate(directory, n_reports, n_peaks=40, n_rows=1000, n_columns=50, pages=1) -> dict:
+    """
+    Writes reports and numeric datasets into directory, existing files are kept.
+
+    :return: dictionary {'reports': list of PDF paths, 'csv': path, 'xlsx': path}
+    """
+    report_paths = reports(directory, n_reports, n_peaks, pages)
+
+    frame = None
+    paths = {}
+    for extension in ['csv', 'xlsx']:
+        path = os.path.join(directory, f'numeric_{n_rows}x{n_columns}.{extension}')
+        if not os.path.exists(path):
+            frame = numeric_frame(n_rows, n_columns) if frame is None else frame
+            if extension == 'csv':
+                frame.to_csv(path, index=False)
+            else:
+                frame.to_excel(path, index=False)
+        paths[extension] = path
+    return dict(reports=report_paths, **paths)
+
+
+def arg_parser() -> argparse.Namespace:
+    arguments = argparse.ArgumentParser(description='Generates synthetic Shimadzu reports and numeric datasets')
+    arguments.add_argument('-o', '--output', default='bench_data', help='output directory')
+    arguments.add_argument('-n', '--reports', type=int, default=200, help='number of PDF reports')
+    arguments.add_argument('--peaks', type=int, default=40, help='peaks per report')
+    arguments.add_argument('--pages', type=int, default=1, help='pages of every report')
+    arguments.add_argument('--rows', type=int, default=1000, help='rows of numeric datasets')
+    arguments.add_argument('--columns', type=int, default=50, help='columns of numeric datasets')
+    return arguments.parse_args()
+
+
+if __name__ == '__main__':
+    args = arg_parser()
+    files = generate(args.output, args.reports, args.peaks, args.rows, args.columns, args.pages)
+    print(f'{len(files["reports"])} reports, {files["csv"]}, {files["xlsx"]}')
@@ -0,0 +1,191 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Retention time binning on a fixed grid
+
+import pandas as pd
+import numpy as np
+from lazy import lazy
+
+sparse = lazy('scipy.sparse')
+
+# default number of retention time bins
+N_BINS = 400
+
+
+def grid(values, n_bins=N_BINS) -> np.ndarray:
+    """
+    Creates equally spaced bin edges covering all values.
+
+    Same edges as pd.cut(values, n_bins), lowest edge is lowered by 0.1 % of the range
+    so the minimum falls into the first right-closed bin.
+
+    :param values: retention times
+    :param n_bins: number of bins
+    :return: array of n_bins + 1 edges
+    """
+    values = np.asarray(values, dtype=float)
+    low, high = values.min(), values.max()
+    if low == high:
+        # pd.cut widens zero range by 0.1 % on both sides
+        low -= 0.001 * abs(low) if low != 0 else 0.001
+        high += 0.001 * abs(high) if high != 0 else 0.001
+        return np.linspace(low, high, n_bins + 1)
+    edges = np.linspace(low, high, n_bins + 1)
+    edges[0] -= (high - low) * 0.001
+    return edges
+
+
+def interval_labels(edges) -> list:
+    """
+    Column labels of bins in pd.cut interval notation, e.g. '(1.234, 1.567]'.
+
+    :param edges: bin edges
+    :return: list of labels, one per bin
+    """
+    width = (edges[-1] - edges[0]) / (len(edges) - 1)
+    # enough decimals to keep neighbouring labels unique
+    decimals = max(3, int(np.ceil(-np.log10(width))) + 2)
+    return [f'({low:.{decimals}f}, {high:.{decimals}f}]' for low, high in zip(edges[:-1], edges[1:])]
+
+
+class RetentionBinner:
+    """
+    Sums peak values of each file into retention time bins given by explicit edges.
+
+    Bins are right-closed intervals (edges[i], edges[i + 1]], peaks outside edges are dropped.
+    Every file is one row of sparse file x bin matrix, only non-empty bins are stored,
+    so memory grows with number of peaks. Adding files appends rows and never touches
+    rows binned before.
+    All value columns (Area, Area%, ...) are binned in one pass, one matrix per column
+    sharing bins of each file, so switching column is a lookup.
+    """
+
+    def __init__(self, edges=None, n_bins=N_BINS):
+        # without edges, grid of n_bins is placed over peaks of first added files
+        self.edges = None if edges is None else np.asarray(edges, dtype=float)
+        self.n_bins = n_bins if edges is None else len(self.edges) - 1
+        self.files = []
+        self.columns = None                                     # value columns, set by first add
+        self._rows = {}                                         # file: (bin indices, cells x columns sums)
+        self._matrix = None                                     # assembled csr matrix, reset by add
+
+    def reset(self):
+        # forgets grid and all rows, next add places new grid over its peaks
+        self.edges = None
+        self.files = []
+        self.columns = None
+        self._rows = {}
+        self._matrix = None
+
+    @classmethod
+    def from_values(cls, values, n_bins=N_BINS):
+        return cls(grid(values, n_bins))
+
+    def __contains__(self, file):
+        return file in self._rows
+
+    def __len__(self):
+        return len(self.files)
+
+    def bin_indices(self, retention_times) -> np.ndarray:
+        """
+        Finds bin of every retention time.
+
+        :param retention_times: array of retention times
+        :return: array of bin indices, -1 for values outside edges
+        """
+        indices = np.searchsorted(self.edges, retention_times, side='left') - 1
+        indices[(indices < 0) | (indices >= self.n_bins)] = -1
+        return indices
+
+    def add(self, files, retention_times, values):
+        """
+        Bins peaks of new files and appends them as rows, peaks of already binned file replace its row.
+
+        :param files: file of every peak
+        :param retention_times: retention time of every peak
+        :param values: dataframe of value columns of every peak, e.g. Area and Area%,
+                       named series for one column
+        """
+        values = pd.DataFrame(values)
+        if self.columns is None:
+            self.columns = [str(column) for column in values.columns]
+        elif [str(column) for column in values.columns] != self.columns:
+            raise ValueError(f'binned columns are {self.columns}, got {values.columns.tolist()}')
+        if self.edges is None:
+            self.edges = grid(retention_times, self.n_bins)
+        codes, new_files = pd.factorize(np.asarray(files))
+        bins = self.bin_indices(np.asarray(retention_times, dtype=float))
+        inside = bins >= 0
+        # sum peaks sharing (file, bin) cell, unique flat indices come out sorted by file and bin
+        flat = codes[inside] * self.n_bins + bins[inside]
+        cells, inverse = np.unique(flat, return_inverse=True)
+        peaks = values.to_numpy(dtype=float)[inside]
+        sums = np.column_stack([
+            np.bincount(inverse, weights=peaks[:, j], minlength=len(cells)) for j in range(peaks.shape[1])
+        ])
+        rows = cells // self.n_bins
+        # boundaries of each file's cells
+        bounds = np.searchsorted(rows, np.arange(len(new_files) + 1))
+
+        for code, file in enumerate(new_files):
+            start, end = bounds[code], bounds[code + 1]
+            if file not in self._rows:
+                self.files.append(file)
+            self._rows[file] = (cells[start:end] % self.n_bins, sums[start:end])
+        self._matrix = None
+
+    @property
+    def matrix(self) -> 'sparse.csr_matrix':
+        """
+        Sparse file x bin matrix of first column, rows in the order files were added.
+        """
+        if self._matrix is None:
+            self._matrix = self.rows(self.files)
+        return self._matrix
+
+    def rows(self, files, column=None) -> 'sparse.csr_matrix':
+        """
+        Sparse matrix of selected files.
+
+        :param files: list of binned files
+        :param column: value column, first one by default
+        :return: csr matrix, one row per file
+        """
+        j = 0 if column is None else self.columns.index(column)
+        row_bins = [self._rows[file][0] for file in files]
+        row_values = [self._rows[file][1][:, j] for file in files]
+        indptr = np.zeros(len(files) + 1, dtype=np.int64)
+        np.cumsum([len(bins) for bins in row_bins], out=indptr[1:])
+        return sparse.csr_matrix(
+            (
+                np.concatenate(row_values) if files else np.zeros(0),
+                np.concatenate(row_bins) if files else np.zeros(0, dtype=np.int64),
+                indptr
+            ),
+            shape=(len(files), self.n_bins)
+        )
+
+    def labels(self) -> list:
+        return interval_labels(self.edges)
+
+    def to_frame(self, files=None, column=None) -> pd.DataFrame:
+        """
+        Dataframe with 'file' column followed by one sparse column per bin, empty bins are 0.
+
+        Bin edges are kept in df.attrs['edges'], see dataset.Dataset.from_frame.
+
+        :param files: selected files, all binned files by default
+        :param column: value column, first one by default
+        :return: dataframe
+        """
+        if files is None:
+            files = self.files
+        df = pd.DataFrame.sparse.from_spmatrix(self.rows(files, column), columns=self.labels())
+        # empty bins are zero, newer pandas fill them with NaN by default
+        zero_fill = pd.SparseDtype(float, 0)
+        if any(dtype != zero_fill for dtype in df.dtypes):
+            df = df.astype(zero_fill)
+        df.insert(0, 'file', files)
+        df.attrs['edges'] = self.edges
+        return df
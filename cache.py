@@ -0,0 +1,166 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Content-addressed cache of extracted tables
+
+import pandas as pd
+import numpy as np
+import functools
+import hashlib
+import json
+import os
+
+# default cache location and size limit, both can be changed in the environment
+CACHE_DIR = os.environ.get('EXTRACTION_CACHE_DIR', os.path.join('uploaded_files', '.cache'))
+CACHE_MAX_BYTES = int(os.environ.get('EXTRACTION_CACHE_MAX_MB', 512)) * 2 ** 20
+
+
+def file_digest(file) -> str:
+    """
+    Hashes file content, same content gives same digest regardless of file name.
+
+    Digests are remembered until file size or modification time changes.
+
+    :param file: file path
+    :return: hex digest
+    """
+    stat = os.stat(file)
+    return content_digest(os.path.abspath(file), stat.st_size, stat.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=4096)
+def content_digest(file, size, mtime_ns, block_size=2 ** 20) -> str:
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def frame2arrays(df: pd.DataFrame) -> dict:
+    """
+    Splits dataframe into one numpy array per column.
+
+    Column names are kept as json, so integer names survive the round trip.
+    Object columns are stored as unicode arrays, so no pickle is needed on load.
+
+    :param df: dataframe
+    :return: dictionary {'name': np.ndarray}
+    """
+    arrays = {'columns': np.array(json.dumps(df.columns.tolist()))}
+    for i, column in enumerate(df.columns):
+        values = df[column].to_numpy()
+        if values.dtype == object:
+            values = values.astype(str)
+        arrays[f'c{i}'] = values
+    return arrays
+
+
+def arrays2frame(arrays) -> pd.DataFrame:
+    """
+    Builds dataframe back from arrays made by frame2arrays.
+
+    :param arrays: dictionary like npz file
+    :return: dataframe
+    """
+    columns = json.loads(str(arrays['columns']))
+    return pd.DataFrame({column: arrays[f'c{i}'] for i, column in enumerate(columns)}, columns=columns)
+
+
+class NpzCache:
+    """
+    Size bounded LRU cache of dataframes stored as compressed npz files.
+
+    Entries are files in one directory, so the cache is shared by all processes.
+    Least recently used entries are evicted when the directory outgrows max_bytes.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(file, extractor, version) -> str:
+        """
+        Creates cache key from file content and extractor version.
+
+        :param file: file path
+        :param extractor: name of extracting function
+        :param version: version of extracting function, bump it when its output changes
+        :return: cache key
+        """
+        return f'{extractor}-v{version}-{file_digest(file)}'
+
+    def path(self, key) -> str:
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        """
+        Loads cached dataframe.
+
+        :param key: cache key
+        :return: dataframe or None when not cached
+        """
+        path = self.path(key)
+        try:
+            with np.load(path, allow_pickle=False) as arrays:
+                df = arrays2frame(arrays)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            # broken entry, extract again
+            print(f'- Cache entry {key} removed: {e}')
+            self.remove(path)
+            self.misses += 1
+            return None
+        # mark entry as recently used
+        os.utime(path)
+        self.hits += 1
+        return df
+
+    def put(self, key, df: pd.DataFrame):
+        """
+        Stores dataframe and evicts least recently used entries over size limit.
+
+        :param key: cache key
+        :param df: dataframe
+        """
+        path = self.path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **frame2arrays(df))
+        # atomic, other processes never see half written entry
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Removes least recently used entries until cache fits into max_bytes.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, path in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            self.remove(path)
+            size -= entry_size
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,188 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Compact dataset of float32 features and categorical sample ids
+
+from binning import interval_labels
+from lazy import lazy
+import pandas as pd
+import numpy as np
+import json
+
+sparse = lazy('scipy.sparse')
+
+
+class Dataset:
+    """
+    Feature matrix of samples with their file names, what every page works on.
+
+    Features are float32, csr matrix for binned chromatograms, C-contiguous array for tables.
+    Binned features are described by numeric bin edges, labels are formatted only for the table.
+    File names and text columns of tables are categoricals, every distinct string is kept once.
+    Table columns are 'file', text columns and features, in this order.
+    """
+
+    def __init__(self, matrix, samples, edges=None, names=None, annotations=None):
+        """
+        :param matrix: csr matrix or array, samples x features
+        :param samples: file of every sample
+        :param edges: bin edges of binned features
+        :param names: feature names of tables, used when edges are None
+        :param annotations: dictionary {'column': text values of every sample}
+        """
+        if sparse.issparse(matrix):
+            self.matrix = sparse.csr_matrix(matrix, dtype=np.float32)
+        else:
+            self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.samples = pd.Categorical(samples)
+        self.edges = None if edges is None else np.asarray(edges, dtype=float)
+        self.names = None if names is None else [str(name) for name in names]
+        self.annotations = {str(column): pd.Categorical(values) for column, values in (annotations or {}).items()}
+        self._positions = None                                  # column: feature index
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'Dataset':
+        """
+        Converts extracted dataframe, numeric columns become features, other columns text.
+
+        Bin edges of binned chromatograms are taken from df.attrs['edges'], see RetentionBinner.to_frame.
+
+        :param df: dataframe with 'file' column
+        :return: dataset
+        """
+        values = df.drop(columns='file')
+        numeric = [column for column in values.columns if pd.api.types.is_numeric_dtype(values[column].dtype)]
+        features = values[numeric]
+        if numeric and all(isinstance(dtype, pd.SparseDtype) for dtype in features.dtypes):
+            matrix = sparse.csr_matrix(features.sparse.to_coo())
+        else:
+            matrix = features.to_numpy(dtype=np.float32)
+        edges = df.attrs.get('edges')
+        if edges is not None and len(edges) != len(numeric) + 1:
+            edges = None
+        annotations = {
+            column: values[column].map(str, na_action='ignore') for column in values.columns if column not in numeric
+        }
+        return cls(matrix, df['file'].astype(str), edges, None if edges is not None else numeric, annotations)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @property
+    def labels(self) -> list:
+        # feature columns of table
+        return interval_labels(self.edges) if self.edges is not None else self.names
+
+    @property
+    def columns(self) -> list:
+        return ['file'] + list(self.annotations) + self.labels
+
+    @property
+    def files(self) -> pd.Series:
+        return pd.Series(self.samples, name='file')
+
+    def __getitem__(self, column) -> pd.Series:
+        """
+        One table column, as filtering.evaluate reads dataframe columns.
+
+        :param column: name from columns
+        :return: series
+        """
+        if column == 'file':
+            return self.files
+        if column in self.annotations:
+            return pd.Series(self.annotations[column], name=column)
+        if self._positions is None:
+            self._positions = {label: i for i, label in enumerate(self.labels)}
+        values = self.matrix[:, self._positions[column]]
+        if sparse.issparse(values):
+            values = values.toarray().ravel()
+        return pd.Series(values, name=column)
+
+    def dense(self, rows=slice(None)) -> np.ndarray:
+        """
+        Features of selected samples as float32 array.
+
+        :param rows: slice, positions or boolean mask
+        :return: array, rows x features
+        """
+        values = self.matrix[rows]
+        return values.toarray() if sparse.issparse(values) else np.asarray(values)
+
+    def take(self, rows) -> 'Dataset':
+        """
+        Dataset of selected samples.
+
+        :param rows: positions or boolean mask
+        :return: dataset sharing bin edges and feature names
+        """
+        annotations = {column: values[rows] for column, values in self.annotations.items()}
+        return Dataset(self.matrix[rows], self.samples[rows], self.edges, self.names, annotations)
+
+    def records(self, rows) -> list:
+        """
+        Table rows as DataTable records.
+
+        Float32 values are sent in their shortest form, 0.1 and not 0.10000000149011612.
+
+        :param rows: slice or positions
+        :return: list of dictionaries {'column': value}
+        """
+        values = self.dense(rows).astype(str).astype(float).tolist()
+        texts = [np.asarray(self.samples[rows], dtype=object)]
+        texts += [np.asarray(column[rows], dtype=object) for column in self.annotations.values()]
+        columns = self.columns
+        return [dict(zip(columns, [text[i] for text in texts] + row)) for i, row in enumerate(values)]
+
+    def to_arrays(self) -> dict:
+        """
+        Splits dataset into numpy arrays, stored as npz without pickle.
+
+        :return: dictionary {'name': np.ndarray}
+        """
+        arrays = {
+            'samples': np.asarray(self.samples.categories, dtype=str),
+            'sample_codes': self.samples.codes,
+            'annotations': np.array(json.dumps(list(self.annotations))),
+        }
+        if sparse.issparse(self.matrix):
+            arrays.update(
+                data=self.matrix.data, indices=self.matrix.indices, indptr=self.matrix.indptr,
+                shape=np.array(self.matrix.shape)
+            )
+        else:
+            arrays['matrix'] = self.matrix
+        if self.edges is not None:
+            arrays['edges'] = self.edges
+        else:
+            arrays['names'] = np.array(self.names, dtype=str)
+        for i, values in enumerate(self.annotations.values()):
+            arrays[f'a{i}'] = np.asarray(values.categories, dtype=str)
+            arrays[f'a{i}_codes'] = values.codes
+        return arrays
+
+    @staticmethod
+    def samples_from_arrays(arrays) -> pd.Categorical:
+        # file names only, other npz members stay on disk
+        return pd.Categorical.from_codes(arrays['sample_codes'], arrays['samples'])
+
+    @classmethod
+    def from_arrays(cls, arrays) -> 'Dataset':
+        """
+        Builds dataset back from arrays made by to_arrays.
+
+        :param arrays: dictionary like npz file
+        :return: dataset
+        """
+        if 'matrix' in arrays:
+            matrix = arrays['matrix']
+        else:
+            matrix = sparse.csr_matrix(
+                (arrays['data'], arrays['indices'], arrays['indptr']), shape=tuple(arrays['shape'])
+            )
+        annotations = {
+            column: pd.Categorical.from_codes(arrays[f'a{i}_codes'], arrays[f'a{i}'])
+            for i, column in enumerate(json.loads(str(arrays['annotations'])))
+        }
+        edges = arrays['edges'] if 'edges' in arrays else None
+        names = arrays['names'].tolist() if 'names' in arrays else None
+        return cls(matrix, cls.samples_from_arrays(arrays), edges, names, annotations)
@@ -0,0 +1,256 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Server-side store of extracted datasets
+
+from dataset import Dataset
+import filtering
+from collections import OrderedDict
+import pandas as pd
+import numpy as np
+import hashlib
+import shutil
+import time
+import os
+import re
+
+STORE_DIRECTORY = os.environ.get('DATASET_STORE_DIR', os.path.join('uploaded_files', '.datasets'))
+# datasets kept loaded in memory of one worker
+MEMORY_DATASETS = 8
+# sessions untouched for longer are removed from disk
+SESSION_MAX_AGE = 24 * 60 * 60
+# datasets of more rows also get feature matrix stored as plain npy, memory mapped by out-of-core PCA
+OUT_OF_CORE_MIN_ROWS = int(os.environ.get('OUT_OF_CORE_MIN_ROWS', 20000))
+# rows converted at once when writing feature matrix
+WRITE_CHUNK_ROWS = 4096
+# session ids are uuid4 hex, dataset ids are sha256 hex
+ID = re.compile(r'^[0-9a-f]{32,64}$')
+
+_datasets = OrderedDict()               # (session, dataset): Dataset, least recently used first
+_views = OrderedDict()                  # (session, dataset, view): row positions, least recently used first
+
+
+def dataset_id(arrays) -> str:
+    """
+    Hashes dataset content, same data gives same id.
+
+    :param arrays: arrays of dataset, see Dataset.to_arrays
+    :return: hex digest
+    """
+    digest = hashlib.sha256()
+    for name in sorted(arrays):
+        values = np.ascontiguousarray(arrays[name])
+        digest.update(f'{name}:{values.dtype.str}:{values.shape}'.encode())
+        digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+def path(handle) -> str:
+    session, dataset = handle['session'], handle['dataset']
+    if not ID.match(session) or not ID.match(dataset):
+        raise ValueError(f'invalid dataset handle: {handle}')
+    return os.path.join(STORE_DIRECTORY, session, dataset + '.npz')
+
+
+def view_path(handle) -> str:
+    if not ID.match(handle['view']):
+        raise ValueError(f'invalid dataset handle: {handle}')
+    return path(handle)[:-len('.npz')] + f'-{handle["view"]}.npy'
+
+
+def features_path(handle) -> str:
+    return path(handle)[:-len('.npz')] + '-features.npy'
+
+
+def remember(memory, key, value):
+    memory[key] = value
+    memory.move_to_end(key)
+    while len(memory) > MEMORY_DATASETS:
+        memory.popitem(last=False)
+
+
+def save(session, data: Dataset) -> dict:
+    """
+    Stores dataset of one session.
+
+    :param session: session id from layout
+    :param data: dataset, see Dataset.from_frame
+    :return: dataset handle {'session': session id, 'dataset': dataset id, 'view': None,
+                             'rows': int, 'columns': int}
+    """
+    arrays = data.to_arrays()
+    handle = {
+        'session': session, 'dataset': dataset_id(arrays), 'view': None, 'rows': len(data),
+        'columns': len(data.columns)
+    }
+    dataset_path = path(handle)
+    if not os.path.exists(dataset_path):
+        cleanup()
+        os.makedirs(os.path.dirname(dataset_path), exist_ok=True)
+        tmp_path = f'{dataset_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, dataset_path)
+    if handle['rows'] >= OUT_OF_CORE_MIN_ROWS and not os.path.exists(features_path(handle)):
+        save_features(handle, data)
+    # mark session as used
+    os.utime(os.path.dirname(dataset_path))
+    remember(_datasets, (session, handle['dataset']), data)
+    return handle
+
+
+def save_features(handle, data: Dataset):
+    """
+    Stores features of dataset as dense float32 npy, written in row chunks.
+
+    :param handle: dataset handle from save
+    :param data: dataset
+    """
+    tmp_path = f'{features_path(handle)}.{os.getpid()}.tmp'
+    matrix = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=data.matrix.shape)
+    for start in range(0, len(data), WRITE_CHUNK_ROWS):
+        matrix[start:start + WRITE_CHUNK_ROWS] = data.dense(slice(start, start + WRITE_CHUNK_ROWS))
+    matrix.flush()
+    del matrix
+    os.replace(tmp_path, features_path(handle))
+
+
+def load_features(handle) -> np.memmap:
+    """
+    Memory maps feature matrix of whole dataset, rows are read from disk only when indexed.
+
+    :param handle: dataset handle from save
+    :return: read-only float32 matrix, samples x features
+    """
+    if not os.path.exists(features_path(handle)):
+        # dataset stored before it outgrew memory
+        save_features(handle, load_stored(handle))
+    return np.load(features_path(handle), mmap_mode='r', allow_pickle=False)
+
+
+def load_files(handle) -> pd.Series:
+    """
+    Loads only file names of dataset or its filtered view.
+
+    :param handle: dataset handle from save or filter_view
+    :return: categorical series of file names
+    """
+    key = (handle['session'], handle['dataset'])
+    if key in _datasets:
+        samples = _datasets[key].samples
+    else:
+        # npz members are decompressed one by one, features stay on disk
+        with np.load(path(handle), allow_pickle=False) as arrays:
+            samples = Dataset.samples_from_arrays(arrays)
+    rows = load_rows(handle)
+    if rows is not None:
+        samples = samples[rows]
+    return pd.Series(samples, name='file')
+
+
+def load_stored(handle) -> Dataset:
+    """
+    Loads whole dataset, from memory when it was used recently by this worker.
+
+    :param handle: dataset handle from save
+    :return: dataset
+    """
+    key = (handle['session'], handle['dataset'])
+    if key in _datasets:
+        _datasets.move_to_end(key)
+        return _datasets[key]
+    with np.load(path(handle), allow_pickle=False) as arrays:
+        data = Dataset.from_arrays(arrays)
+    remember(_datasets, key, data)
+    return data
+
+
+def load_rows(handle) -> np.ndarray:
+    """
+    Loads row positions of filtered view.
+
+    :param handle: dataset handle from filter_view
+    :return: array of row positions, None for whole dataset
+    """
+    if handle.get('view') is None:
+        return None
+    key = (handle['session'], handle['dataset'], handle['view'])
+    if key not in _views:
+        remember(_views, key, np.load(view_path(handle), allow_pickle=False))
+    _views.move_to_end(key)
+    return _views[key]
+
+
+def load(handle) -> Dataset:
+    """
+    Loads dataset or its filtered view.
+
+    :param handle: dataset handle from save or filter_view
+    :return: dataset
+    """
+    data = load_stored(handle)
+    rows = load_rows(handle)
+    if rows is not None:
+        data = data.take(rows)
+    return data
+
+
+def filter_view(handle, query) -> dict:
+    """
+    Creates view of dataset rows matching DataTable filter query.
+
+    Matching row positions are computed once per query and stored next to the dataset,
+    pages then load only the rows of the view.
+
+    :param handle: dataset handle from save
+    :param query: DataTable filter_query
+    :return: dataset handle with 'view' id and number of 'rows' in view
+    """
+    handle = dict(handle, view=None)
+    if query is None or not query.strip():
+        handle['rows'] = len(load_stored(handle))
+        return handle
+
+    handle['view'] = hashlib.sha256(query.strip().encode()).hexdigest()[:32]
+    key = (handle['session'], handle['dataset'], handle['view'])
+    if key not in _views and not os.path.exists(view_path(handle)):
+        rows = filtering.filter_rows(load_stored(handle), query)
+        tmp_path = f'{view_path(handle)}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, rows)
+        os.replace(tmp_path, view_path(handle))
+        remember(_views, key, rows)
+    handle['rows'] = len(load_rows(handle))
+    return handle
+
+
+def page(handle, page_current, page_size) -> list:
+    """
+    Gets rows of one table page.
+
+    :param handle: dataset handle from save or filter_view
+    :param page_current: page number starting from 0
+    :param page_size: rows per page
+    :return: list of records
+    """
+    data = load_stored(handle)
+    rows = load_rows(handle)
+    start = page_current * page_size
+    if rows is not None:
+        # only rows of the page are taken from the dataset
+        return data.records(rows[start:start + page_size])
+    return data.records(slice(start, start + page_size))
+
+
+def cleanup():
+    """
+    Removes sessions not used for SESSION_MAX_AGE.
+    """
+    if not os.path.isdir(STORE_DIRECTORY):
+        return
+    now = time.time()
+    for entry in os.scandir(STORE_DIRECTORY):
+        try:
+            if entry.is_dir() and now - entry.stat().st_mtime > SESSION_MAX_AGE:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,313 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Server-side evaluation of DataTable filter queries
+
+import pandas as pd
+import numpy as np
+import re
+
+# filter query tokens, e.g. {Area} > 5 && {file} contains "D 1"
+# relational operators typed into column filters come with case prefix, e.g. {Area} s> 5, {file} icontains d
+TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<column>\{(?:[^}\\]|\\.)*\})
+      | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|`(?:[^`\\]|\\.)*`)
+      | (?P<parenthesis>[()])
+      | (?P<operator>&&|\|\||[is]?(?:!=|<=|>=|=|<|>)|!)
+      | (?P<word>[^\s(){}"'`!<>=&|]+)
+    )''', re.VERBOSE)
+# operator aliases of the DataTable syntax
+ALIASES = {
+    'and': '&&', 'or': '||', 'not': '!',
+    'eq': '=', 'ne': '!=', 'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>=',
+}
+RELATIONAL = ['=', '!=', '<', '<=', '>', '>=', 'contains', 'datestartswith']
+# case prefixes of relational operators, 's' sensitive is the default, 'i' ignores case
+CASE_PREFIXES = 'is'
+UNARY = ['blank', 'nil', 'num', 'str', 'bool', 'even', 'odd']
+
+
+def relational(word):
+    """
+    Normalizes relational operator, case prefix 's' is dropped and 'i' kept.
+
+    :param word: operator as typed, e.g. 'contains', 'icontains', 's>', 'ieq'
+    :return: operator from RELATIONAL, prefixed by 'i' when case is ignored, None for other words
+    """
+    word = word.lower()
+    for prefix in ['', *CASE_PREFIXES]:
+        if word.startswith(prefix):
+            operator = ALIASES.get(word[len(prefix):], word[len(prefix):])
+            if operator in RELATIONAL:
+                return 'i' + operator if prefix == 'i' else operator
+    return None
+
+
+def operator_word(token):
+    """
+    Operator named by token, words like 'and', 'ne' or 'icontains' included.
+
+    :param token: (kind, value) pair
+    :return: operator, None when token is not one
+    """
+    kind, value = token
+    if kind == 'operator':
+        return value
+    if kind == 'word':
+        word = value.lower()
+        if word == 'is':
+            return word
+        return relational(word) or ALIASES.get(word)
+    return None
+
+
+def tokenize(query) -> list:
+    """
+    Splits filter query into tokens.
+
+    :param query: DataTable filter_query
+    :return: list of (kind, value) pairs, kind is 'column', 'value', 'parenthesis', 'operator' or 'word'
+    """
+    tokens = []
+    position = 0
+    query = query.rstrip()
+    while position < len(query):
+        match = TOKEN.match(query, position)
+        if match is None:
+            raise ValueError(f'invalid filter query at: {query[position:]}')
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'column':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        elif kind == 'string':
+            kind = 'value'
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        elif kind == 'operator':
+            # &&, || and ! are not relational
+            value = relational(value) or value
+        # bare words stay words, parser decides from position whether they are operators or values
+        tokens.append((kind, value))
+    return tokens
+
+
+class Parser:
+    """
+    Recursive descent parser building expression tree from tokens.
+
+    Tree nodes are tuples: ('||', left, right), ('&&', left, right), ('!', operand),
+    (operator, column, value) for relations and ('is', column, check) for unary checks.
+    Relations ignoring case have operator prefixed by 'i', e.g. 'icontains'.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None, None
+
+    def take(self, kind=None):
+        token = self.peek()
+        if token[0] is None or (kind is not None and token[0] != kind):
+            raise ValueError(f'expected {kind or "token"}, got {token[1]}')
+        self.position += 1
+        return token
+
+    def parse(self):
+        tree = self.parse_or()
+        if self.position != len(self.tokens):
+            raise ValueError(f'unexpected {self.peek()[1]}')
+        return tree
+
+    def parse_or(self):
+        tree = self.parse_and()
+        while operator_word(self.peek()) == '||':
+            self.take()
+            tree = ('||', tree, self.parse_and())
+        return tree
+
+    def parse_and(self):
+        tree = self.parse_unary()
+        while operator_word(self.peek()) == '&&':
+            self.take()
+            tree = ('&&', tree, self.parse_unary())
+        return tree
+
+    def parse_unary(self):
+        if operator_word(self.peek()) == '!':
+            self.take()
+            return '!', self.parse_unary()
+        if self.peek() == ('parenthesis', '('):
+            self.take()
+            tree = self.parse_or()
+            if self.take('parenthesis')[1] != ')':
+                raise ValueError('missing )')
+            return tree
+        return self.parse_relation()
+
+    def value(self) -> str:
+        # any word after operator is value, even 'ne' or 'and'
+        kind, value = self.peek()
+        if kind not in ['value', 'word']:
+            raise ValueError(f'expected value, got {value}')
+        self.position += 1
+        return value
+
+    def parse_relation(self):
+        column = self.take('column')[1]
+        token = self.take()
+        operator = operator_word(token)
+        if operator is None:
+            raise ValueError(f'expected operator, got {token[1]}')
+        if operator == 'is':
+            check = self.value().lower()
+            if check not in UNARY:
+                raise ValueError(f'unknown check: is {check}')
+            return 'is', column, check
+        if operator not in RELATIONAL and operator[1:] not in RELATIONAL:
+            raise ValueError(f'unexpected {operator}')
+        return operator, column, self.value()
+
+
+def parse(query):
+    """
+    Parses DataTable filter query.
+
+    Queries of column filters, as sent by the table:
+
+    >>> parse('{file} scontains f1')
+    ('contains', 'file', 'f1')
+    >>> parse('{file} icontains F1 && {Area} s> 5')
+    ('&&', ('icontains', 'file', 'F1'), ('>', 'Area', '5'))
+    >>> parse('{Area} i<= 5 || {Area} s= 7')
+    ('||', ('i<=', 'Area', '5'), ('=', 'Area', '7'))
+    >>> parse('{file} ieq "D 1"')
+    ('i=', 'file', 'D 1')
+
+    :param query: filter_query, e.g. '{Area} > 5 && {file} contains D'
+    :return: expression tree, None for empty query
+    """
+    if query is None or not query.strip():
+        return None
+    return Parser(tokenize(query)).parse()
+
+
+def number(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def relation(series: pd.Series, operator, value) -> np.ndarray:
+    """
+    Evaluates one relation over whole column.
+
+    :param series: dataframe column
+    :param operator: one of RELATIONAL, prefixed by 'i' to ignore case
+    :param value: value from query
+    :return: boolean mask
+    """
+    numeric = pd.api.types.is_numeric_dtype(series.dtype)
+    # no operator of RELATIONAL starts with 'i'
+    ignore_case = operator.startswith('i')
+    if ignore_case:
+        operator = operator[1:]
+    if operator == 'contains':
+        return series.astype(str).str.contains(value, case=not ignore_case, regex=False).to_numpy(dtype=bool)
+
+    if numeric and operator != 'datestartswith':
+        value = number(value)
+        if value is None:
+            # text never equals number column
+            return np.full(len(series), operator == '!=')
+        values = series.to_numpy()
+        if values.dtype.kind == 'f':
+            # query value rounded as the column, float32 0.1 shown in table equals query 0.1
+            value = values.dtype.type(value)
+        else:
+            values = values.astype(float)
+    else:
+        texts = series.astype(str)
+        if ignore_case:
+            texts, value = texts.str.lower(), value.lower()
+        if operator == 'datestartswith':
+            return texts.str.startswith(value).to_numpy(dtype=bool)
+        values = texts.to_numpy()
+    with np.errstate(invalid='ignore'):
+        if operator == '=':
+            return values == value
+        elif operator == '!=':
+            return values != value
+        elif operator == '<':
+            return values < value
+        elif operator == '<=':
+            return values <= value
+        elif operator == '>':
+            return values > value
+        return values >= value
+
+
+def check(series: pd.Series, name) -> np.ndarray:
+    """
+    Evaluates unary check, e.g. 'is blank'.
+
+    :param series: dataframe column
+    :param name: one of UNARY
+    :return: boolean mask
+    """
+    missing = series.isna().to_numpy(dtype=bool)
+    numeric = pd.api.types.is_numeric_dtype(series.dtype)
+    if name == 'nil':
+        return missing
+    elif name == 'blank':
+        return missing | (series.astype(str).str.strip() == '').to_numpy(dtype=bool)
+    elif name == 'num':
+        return ~missing if numeric else np.zeros(len(series), dtype=bool)
+    elif name == 'str':
+        return ~missing if not numeric else np.zeros(len(series), dtype=bool)
+    elif name == 'bool':
+        return ~missing if pd.api.types.is_bool_dtype(series.dtype) else np.zeros(len(series), dtype=bool)
+    if not numeric:
+        return np.zeros(len(series), dtype=bool)
+    remainder = np.mod(series.to_numpy(dtype=float), 2)
+    return remainder == 0 if name == 'even' else remainder == 1
+
+
+def evaluate(tree, df: pd.DataFrame) -> np.ndarray:
+    """
+    Evaluates expression tree over dataframe, whole columns at once.
+
+    :param tree: expression tree from parse
+    :param df: dataframe
+    :return: boolean mask of matching rows
+    """
+    if tree is None:
+        return np.ones(len(df), dtype=bool)
+    operator = tree[0]
+    if operator == '||':
+        return evaluate(tree[1], df) | evaluate(tree[2], df)
+    elif operator == '&&':
+        return evaluate(tree[1], df) & evaluate(tree[2], df)
+    elif operator == '!':
+        return ~evaluate(tree[1], df)
+    column = tree[1]
+    if column not in df.columns:
+        raise ValueError(f'unknown column: {column}')
+    if operator == 'is':
+        return check(df[column], tree[2])
+    return relation(df[column], operator, tree[2])
+
+
+def filter_rows(df: pd.DataFrame, query) -> np.ndarray:
+    """
+    Finds rows matching DataTable filter query.
+
+    :param df: dataframe or dataset.Dataset, anything with columns, len and column series
+    :param query: filter_query
+    :return: array of matching row positions
+    """
+    return np.flatnonzero(evaluate(parse(query), df))
@@ -4,6 +4,10 @@
 
 # DASH
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
+from binning import RetentionBinner
+from dataset import Dataset
+from collections import OrderedDict
 import dash_html_components as html
 import dash_core_components as dcc
 from app import app
@@ -11,22 +15,41 @@ import dash_table
 import dash
 
 # internal packages
-from apps import pca, dendrogram, tsne, umap, control_chart      # sub-pages
+import importlib                                # sub-pages
 import pandas as pd
 
 # MISCELLANEOUS
 import parser                                   # pdf parser file
+import upload                                   # streaming upload route
+import metrics                                  # callback metrics, /metrics route
+import datastore                                # server-side datasets
 import base64                                   # decoding/encoding
+import json
+import math
+import uuid                                     # session ids
 import os                                       # path
 
 # necessary global variables
-DIRECTORY = "uploaded_files"
+DIRECTORY = upload.DIRECTORY
+# rows of one table page
+PAGE_SIZE = 20
+# sub-pages: url path -> module, imported by register_pages
+PAGES = {
+    '/apps/pca': 'apps.pca',
+    '/apps/dendrogram': 'apps.dendrogram',
+    '/apps/tsne': 'apps.tsne',
+    '/apps/umap': 'apps.umap',
+}
+# retention grids of chromatograms kept in memory of one worker, see session_binner
+MEMORY_BINNERS = 8
 extraktor_logo = 'assets/extRaktor_logo.png'
 plotly_logo = 'assets/footer_plotly.png'
 encoded_image = base64.b64encode(open(extraktor_logo, 'rb').read())
 plotly_encoded_image = base64.b64encode(open(plotly_logo, 'rb').read())
 
-app.layout = html.Div(
+_binners = OrderedDict()                # session: RetentionBinner, least recently used first
+
+layout = html.Div(
     [
         html.Div(
             [  # first row - navbar
@@ -80,6 +103,10 @@ app.layout = html.Div(
         ),
         # hidden div / storing filenames between callbacks
         html.Div(id='div-storing-filenames', style={'display': 'none'}),
+        # handle of extracted dataset kept on server, see datastore.py
+        dcc.Store(id='dataset'),
+        # handle of dataset rows matching table filter, used by sub-pages
+        dcc.Store(id='dataset-view'),
         html.Div(
             [  # third row - upload
                 html.Div(
@@ -102,7 +129,8 @@ app.layout = html.Div(
                 ),
                 html.Div(
                     [   # upload
-                        dcc.Upload(
+                        # files are streamed to upload.py route by assets/upload.js
+                        html.Div(
                             id='upload-data',
                             children=html.Div([
                                 'Drag and Drop or Click to ',
@@ -110,8 +138,8 @@ app.layout = html.Div(
                                 html.Br(),
                                 'PDF can be only Shimadzu Analysis Reports (4 files minimum)',
                                 html.Br(),
-                                'CSV file must contain only numeric data (1 file maximum)'
-
+                                'CSV file must contain only numeric data (1 file maximum)',
+                                html.P(id='upload-status'),
                             ]),
                             style={
                                 'position': 'fixed',
@@ -128,12 +156,14 @@ app.layout = html.Div(
                                 'display': 'inline',
                                 'color': '#CECECE'
                             },
-                            style_active={
-                                'background': '#232323',
-                            },
-                            multiple=True,
                             className='twelve columns'
                         ),
+                        # ids of uploaded files, written by assets/upload.js
+                        dcc.Input(
+                            id='upload-ids',
+                            type='text',
+                            style={'display': 'none'}
+                        ),
                     ],  # div Upload nad Image
                 ),
             ],
@@ -257,17 +287,35 @@ app.layout = html.Div(
 )
 
 
+def serve_layout():
+    """
+    Creates layout for every page load, each browser tab gets its own session id.
+
+    :return: main layout with session id store
+    """
+    return html.Div(
+        [
+            layout,
+            dcc.Store(id='session-id', data=uuid.uuid4().hex),
+        ]
+    )
+
+
+app.layout = serve_layout
+
+
 # - - - - - - - - - - HELPER FUNCTIONS - - - - - - - - - -
-def save_files(name, content):
-    # store uploaded file(s)
-    if os.path.isfile(DIRECTORY + '/' + name):
-        print(f'File {name} exists, skipping upload.')
-    else:
-        print(f'Uploading file: {name}')
-        data = content.encode("utf8").split(b";base64,")[1]
-        # TODO create before?
-        with open(os.path.join(DIRECTORY, name), "wb") as fp:
-            fp.write(base64.decodebytes(data))
+def register_pages():
+    """
+    Imports sub-pages, which registers their layouts and callbacks.
+
+    Callbacks have to be known before the first request, so pages are imported at startup.
+    Pages import sklearn, umap, plotly express and PDF libraries lazily (see lazy.py),
+    so this costs only layouts and callback registration.
+
+    :return: dictionary {'url path': page module}
+    """
+    return {pathname: importlib.import_module(module) for pathname, module in PAGES.items()}
 
 
 def get_optional_extracts(filenames):
@@ -300,12 +348,36 @@ def get_optional_extracts(filenames):
     return options, first_option
 
 
-def parse_contents(filenames, optional_extract):
+def session_binner(session, files) -> RetentionBinner:
+    """
+    Retention grid of session, reused while files are only appended to extracted ones.
+
+    Appended chromatograms then keep columns of earlier ones, only new files are extracted
+    and their rows can be placed into existing maps, e.g. stable UMAP.
+    New peaks outside the grid and other file sets get new grid, placement then fits again.
+    Binner holds all value columns, switching extracted column only reads another one.
+
+    :param session: session id
+    :param files: list of file paths
+    :return: binning.RetentionBinner
+    """
+    binner = _binners.get(session)
+    if binner is None or not set(binner.files) <= set(files):
+        binner = RetentionBinner()
+    _binners[session] = binner
+    _binners.move_to_end(session)
+    while len(_binners) > MEMORY_BINNERS:
+        _binners.popitem(last=False)
+    return binner
+
+
+def parse_contents(filenames, optional_extract, session=None):
     """
 
 
     :param filenames:
     :param optional_extract:
+    :param session: session id, chromatograms of one session share retention grid
     :return: parsed: pd.Dataframe
     """
     print(f'extracting column: {optional_extract}')
@@ -320,9 +392,13 @@ def parse_contents(filenames, optional_extract):
         parsed['file'] = filenames[0]
     elif file_ext == '.pdf':
         try:
-            parsed = parser.extract_shimadzu(filenames, optional_extract)
+            binner = None if session is None else session_binner(session, filenames)
+            tables = parser.extract(filenames, optional_extract, binner=binner)
+            if len(tables) > 1:
+                raise ValueError(f'mixed file types: {list(tables)}')
+            parsed = tables.popitem()[1]
             # cut file path
-            parsed['file'] = parsed['file'].str.split('/').str[1]
+            parsed['file'] = parsed['file'].str.split('/').str[-1]
         except Exception as e:
             print(e)
             return html.Div([
@@ -332,6 +408,9 @@ def parse_contents(filenames, optional_extract):
     return parsed
 
 
+pages = register_pages()
+
+
 # - - - - - - - - - - CALLBACKS - - - - - - - - - -
 
 
@@ -344,29 +423,31 @@ def parse_contents(filenames, optional_extract):
         Output('input-div', 'style'),
         Output('dropdown-extract', 'value'),
         Output('dropdown-extract', 'options'),
-        Output('div-storing-filenames', 'children')
+        Output('div-storing-filenames', 'children'),
+        Output('dataset', 'data'),
     ],
     [   # triggers callback when
-        Input('upload-data', 'contents'),                       # user select files
+        Input('upload-ids', 'value'),                           # user uploaded files
         Input('btn-load-sample', 'n_clicks'),                   # button is pressed
         Input('btn-iris-sample', 'n_clicks'),                   # button is pressed
         Input('dropdown-extract', 'value')                      # another column for extraction is selected
     ],
     [   # does not trigger callback
-        State('upload-data', 'filename'),                       # filenames from upload element
-        State('div-storing-filenames', 'children')              # aux. state: filenames shared betweem callbacks
+        State('div-storing-filenames', 'children'),             # aux. state: filenames shared betweem callbacks
                                                                 # needed for additional column extraction
+        State('session-id', 'data'),                            # session owning stored datasets
     ])
-def files2table(contents, sample_clicks, iris_clicks, extract_column, filenames, stored_filenames):  # , date):
+@metrics.instrument('files2table')
+def files2table(upload_ids, sample_clicks, iris_clicks, extract_column, stored_filenames, session):  # , date):
     """
 
-    :param contents: content of the extracted files
+    :param upload_ids: json with ids of uploaded files
     :param sample_clicks:
     :param iris_clicks:
     :param extract_column: column to be actracted
-    :param filenames:
     :param stored_filenames:
-    :return: dash_table.DataTable
+    :param session: session id
+    :return: dash_table.DataTable with first page, dataset handle
     """
     hide = {'display': 'none'}
     show = {'display': 'inline'}
@@ -374,18 +455,16 @@ def files2table(contents, sample_clicks, iris_clicks, extract_column, filenames,
 
     print(f'stored_filenames: {stored_filenames}')
 
-    # use new filenames from upload, or actual working filenames
-    if filenames is not None:
-        working_filenames = filenames
-    else:
-        working_filenames = stored_filenames
+    # actual working filenames, replaced by new files below
+    working_filenames = stored_filenames
 
     # determine which input triggered this callback
     trigger = dash.callback_context.triggered[0]['prop_id'].split('.')[0]
-    if trigger == 'upload-data':
-        # new files are saved into uploaded_directory
-        for file, content in zip(working_filenames, contents):
-            save_files(file, content)
+    if trigger == 'upload-ids':
+        # uploaded files are already saved in uploaded_directory/<file id>/<name>
+        working_filenames = [
+            os.path.relpath(upload.file_path(file_id), DIRECTORY) for file_id in json.loads(upload_ids)['ids']
+        ]
     elif trigger == 'btn-load-sample':
         # use data from sample file
         working_filenames = ['samples3.xlsx']
@@ -397,7 +476,7 @@ def files2table(contents, sample_clicks, iris_clicks, extract_column, filenames,
     print(f'triggered by: {trigger}')
     print(f'filenames: {working_filenames}')
 
-    file_path = [DIRECTORY + '/' + filename for filename in working_filenames]  # TODO move in from of save
+    file_path = [DIRECTORY + '/' + filename for filename in working_filenames]
 
     # get dict of optional columns for extraction + string with name of first column
     options, first_option = get_optional_extracts(file_path)
@@ -406,7 +485,7 @@ def files2table(contents, sample_clicks, iris_clicks, extract_column, filenames,
         extract_column = first_option
 
     # print(f'extract_column: {extract_column}')
-    df = parse_contents(file_path, extract_column)
+    df = parse_contents(file_path, extract_column, session)
     # fetching the number of rows and columns
     #rows = df.shape[0]
     #cols = df.shape[1]
@@ -421,14 +500,23 @@ def files2table(contents, sample_clicks, iris_clicks, extract_column, filenames,
     #print(f'options: {options}')
     print(f'{df}')
 
-    # returns whole datatable into parent div
+    # dataset stays on server as float32 features and categorical file names,
+    # table and sub-pages get only its handle
+    data = Dataset.from_frame(df)
+    dataset = datastore.save(session, data)
+
+    # returns datatable with first page into parent div, other pages are sent by update_table_page
     return dash_table.DataTable(
         id='table',
-        columns=[{"name": i, "id": i} for i in df.columns],
-        data=df.to_dict('records'),
-        page_size=20,
+        columns=[{"name": i, "id": i} for i in data.columns],
+        data=datastore.page(dataset, 0, PAGE_SIZE),
+        page_action='custom',
+        page_current=0,
+        page_size=PAGE_SIZE,
+        page_count=max(1, math.ceil(len(data) / PAGE_SIZE)),
         # editable=True,
-        filter_action='native',
+        filter_action='custom',
+        filter_query='',
         fixed_columns={  # fixed first column when scrolling horizontaly
             'headers': True,
             'data': 1
@@ -451,7 +539,65 @@ def files2table(contents, sample_clicks, iris_clicks, extract_column, filenames,
             'color': '#CECECE',
             'border': '2px solid #2A3441',
         }
-    ), show, show_footer, hide, hide, extract_column, options, working_filenames
+    ), show, show_footer, hide, hide, extract_column, options, working_filenames, dataset
+
+
+@app.callback(
+    [
+        Output('dataset-view', 'data'),
+        Output('table', 'page_current'),
+    ],
+    [
+        Input('table', 'filter_query'),
+        Input('dataset', 'data'),
+    ],
+    prevent_initial_call=True
+)
+def filter_table(filter_query, dataset):
+    """
+    Filters stored dataset on server, see filtering.py.
+
+    :param filter_query: DataTable filter query
+    :param dataset: dataset handle
+    :return: handle of filtered view, first page
+    """
+    if dataset is None:
+        raise PreventUpdate
+    print(f'filtering table: {filter_query}')
+    try:
+        view = datastore.filter_view(dataset, filter_query)
+    except ValueError as e:
+        # keep last valid view while query is being typed
+        print(e)
+        raise PreventUpdate
+    return view, 0
+
+
+@app.callback(
+    [
+        Output('table', 'data'),
+        Output('table', 'page_count'),
+    ],
+    [
+        Input('table', 'page_current'),
+        Input('table', 'page_size'),
+        Input('dataset-view', 'data'),
+    ],
+    prevent_initial_call=True
+)
+def update_table_page(page_current, page_size, view):
+    """
+    Sends one page of stored dataset view to the table.
+
+    :param page_current: page number starting from 0
+    :param page_size: rows per page
+    :param view: dataset handle from filter_table
+    :return: list of records, number of pages
+    """
+    if view is None:
+        raise PreventUpdate
+    page_count = max(1, math.ceil(view['rows'] / page_size))
+    return datastore.page(view, page_current or 0, page_size), page_count
 
 
 @app.callback(
@@ -462,6 +608,7 @@ def files2table(contents, sample_clicks, iris_clicks, extract_column, filenames,
     Input('url', 'pathname'),               # click in link in navbar triggers this callback
     prevent_initial_call=True
 )
+@metrics.instrument('goto_page')
 def goto_page(pathname):
     """
 
@@ -473,16 +620,8 @@ def goto_page(pathname):
     hide = {'display': 'none'}
     disp_inline = {'display': 'inline'}
 
-    if pathname == '/apps/pca':
-        return pca.layout, hide
-    elif pathname == '/apps/dendrogram':
-        return dendrogram.layout, hide
-    elif pathname == '/apps/tsne':
-        return tsne.layout, hide
-    elif pathname == '/apps/umap':
-        return umap.layout, hide
-    elif pathname == '/apps/cc':
-        return control_chart.layout, hide
+    if pathname in pages:
+        return pages[pathname].layout, hide
     elif pathname == '/':
         return 'http://extraktor.herokuapp.com/', disp_inline
 
@@ -0,0 +1,278 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Background jobs for long running embeddings
+
+import multiprocessing
+import profiling
+import threading
+import numpy as np
+import hashlib
+import json
+import time
+import os
+import sys
+import re
+
+JOB_DIRECTORY = os.environ.get('JOB_DIR', os.path.join('uploaded_files', '.jobs'))
+# jobs computed at once by one server worker, every job runs in its own process
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+# seconds between checks of running process, its log and cancel flag
+POLL_INTERVAL = 0.5
+# finished jobs older than this are removed from disk
+JOB_MAX_AGE = 24 * 60 * 60
+# job ids are sha256 hex of function and arguments
+ID = re.compile(r'^[0-9a-f]{32}$')
+# states of jobs which are not computed again when submitted
+ACTIVE = ['queued', 'running', 'done']
+
+# queued jobs wait in their threads for one of JOB_WORKERS slots,
+# processes are not forked from executor threads, their exit handlers would fail in child
+_slots = threading.BoundedSemaphore(JOB_WORKERS)
+
+
+def path(job_id, suffix) -> str:
+    if not ID.match(job_id):
+        raise ValueError(f'invalid job id: {job_id}')
+    return os.path.join(JOB_DIRECTORY, job_id + suffix)
+
+
+def job_id(function, kwargs) -> str:
+    """
+    Identifies job by function and its arguments, same job submitted twice is computed once.
+
+    :param function: module level function
+    :param kwargs: json serializable arguments
+    :return: hex digest
+    """
+    key = json.dumps([function.__module__, function.__name__, kwargs], sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def write_status(job_id, **status):
+    status = dict(read_status(job_id) or {}, id=job_id, updated=time.time(), **status)
+    tmp_path = f'{path(job_id, ".json")}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(status, f)
+    os.replace(tmp_path, path(job_id, '.json'))
+
+
+def read_status(job_id) -> dict:
+    try:
+        with open(path(job_id, '.json')) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def alive(status) -> bool:
+    """
+    Checks whether server process computing unfinished job still exists.
+
+    :param status: job status
+    :return: False when the job was left behind by stopped server worker
+    """
+    if status['state'] not in ['queued', 'running']:
+        return True
+    try:
+        os.kill(status['server'], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def submit(function, progress=None, total=None, profile=None, **kwargs) -> str:
+    """
+    Queues function to be computed in background process.
+
+    Function runs in its own process, so it can be cancelled at any moment and keeps
+    server worker free. Its stdout and stderr go to log of the job, progress is
+    parsed from the log.
+
+    :param function: module level function returning numpy array
+    :param progress: regular expression with group 'done' and optional 'total' matching progress lines of log
+    :param total: number of steps when progress does not match 'total'
+    :param profile: name of profile written by job process, None not to profile, see profiling.call
+    :param kwargs: json serializable arguments of function
+    :return: job id
+    """
+    job = job_id(function, kwargs)
+    status = read_status(job)
+    if status is not None and status['state'] in ACTIVE and alive(status):
+        return job
+
+    cleanup()
+    os.makedirs(JOB_DIRECTORY, exist_ok=True)
+    for suffix in ['.cancel', '.log', '.npy']:
+        if os.path.exists(path(job, suffix)):
+            os.remove(path(job, suffix))
+    write_status(
+        job, state='queued', progress=0, message='queued', server=os.getpid(),
+        submitted=time.time(), started=None, finished=None
+    )
+    threading.Thread(
+        target=run, args=(job, function, kwargs, progress, total, profile), name=f'job-{job[:8]}', daemon=True
+    ).start()
+    return job
+
+
+def work(function, kwargs, log_path, result_path, profile=None):
+    """
+    Body of job process, computes function and stores its result.
+
+    Output goes to log through file descriptors, so progress printed by
+    compiled code (numba, cython) is logged as well.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with open(log_path, 'ab', buffering=0) as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+    # progress lines reach the log as soon as they are printed
+    sys.stdout.reconfigure(line_buffering=True)
+    if profile:
+        result = profiling.call(profile, function, **kwargs)
+    else:
+        result = function(**kwargs)
+    tmp_path = f'{result_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, result)
+    os.replace(tmp_path, result_path)
+
+
+def parse_progress(job_id, progress, total) -> (float, str):
+    """
+    Finds last progress line in log of job.
+
+    :return: fraction done, progress message; None, None when nothing matched yet
+    """
+    if progress is None:
+        return None, None
+    try:
+        with open(path(job_id, '.log'), errors='replace') as f:
+            log = f.read()
+    except FileNotFoundError:
+        return None, None
+    matches = list(re.finditer(progress, log))
+    if not matches:
+        return None, None
+    last = matches[-1].groupdict()
+    done = int(last['done'])
+    total = int(last.get('total') or total or 0)
+    if not total:
+        return None, f'{done} done'
+    return min(done / total, 1), f'{done} / {total}'
+
+
+def run(job_id, function, kwargs, progress, total, profile=None):
+    """
+    Runs job in separate process and follows it until it ends or is cancelled.
+
+    Runs in thread of its own, JOB_WORKERS jobs at once.
+    """
+    with _slots:
+        follow(job_id, function, kwargs, progress, total, profile)
+
+
+def follow(job_id, function, kwargs, progress, total, profile=None):
+    if os.path.exists(path(job_id, '.cancel')):
+        write_status(job_id, state='cancelled', message='cancelled', finished=time.time())
+        return
+    process = multiprocessing.Process(
+        target=work, args=(function, kwargs, path(job_id, '.log'), path(job_id, '.npy'), profile), daemon=True
+    )
+    process.start()
+    write_status(job_id, state='running', message='started', started=time.time())
+    print(f'job {job_id[:8]} started: {function.__name__}, pid {process.pid}')
+
+    cancelled = False
+    while process.is_alive():
+        process.join(POLL_INTERVAL)
+        if os.path.exists(path(job_id, '.cancel')):
+            process.terminate()
+            process.join()
+            cancelled = True
+            break
+        fraction, message = parse_progress(job_id, progress, total)
+        if message is not None:
+            write_status(job_id, progress=fraction, message=message)
+
+    if cancelled:
+        write_status(job_id, state='cancelled', message='cancelled', finished=time.time())
+    elif process.exitcode == 0 and os.path.exists(path(job_id, '.npy')):
+        write_status(job_id, state='done', progress=1, message='done', finished=time.time())
+    else:
+        write_status(job_id, state='failed', message=log_tail(job_id), finished=time.time())
+    print(f'job {job_id[:8]} {read_status(job_id)["state"]}')
+
+
+def log_tail(job_id, lines=1) -> str:
+    try:
+        with open(path(job_id, '.log'), errors='replace') as f:
+            tail = f.read().strip().splitlines()[-lines:]
+    except FileNotFoundError:
+        tail = []
+    return '\n'.join(tail) or 'failed'
+
+
+def status(job_id) -> dict:
+    """
+    Gets status of job, shared by all server workers.
+
+    :param job_id: id from submit
+    :return: {'id', 'state': queued | running | done | failed | cancelled, 'progress': 0..1 or None,
+              'message', 'submitted', 'started', 'finished'}, None for unknown job
+    """
+    status = read_status(job_id)
+    if status is not None and not alive(status):
+        status = dict(status, state='failed', message='server worker stopped')
+    return status
+
+
+def result(job_id) -> np.ndarray:
+    """
+    Loads result of finished job.
+
+    :param job_id: id from submit
+    :return: array returned by function
+    """
+    return np.load(path(job_id, '.npy'), allow_pickle=False)
+
+
+def cancel(job_id):
+    """
+    Asks job to stop, queued job never starts, running process is terminated.
+
+    :param job_id: id from submit
+    """
+    open(path(job_id, '.cancel'), 'a').close()
+
+
+def supersede(previous, job_id=None):
+    """
+    Cancels job shown before when callback replaces it, nobody waits for its result anymore.
+
+    :param previous: job store data of the page, {'id': job id or None, ...}, None before first job
+    :param job_id: id of job replacing it, the same job is kept
+    """
+    if not previous or previous.get('id') in (None, job_id):
+        return
+    status = read_status(previous['id'])
+    if status is not None and status['state'] in ['queued', 'running']:
+        cancel(previous['id'])
+
+
+def cleanup():
+    """
+    Removes files of jobs finished more than JOB_MAX_AGE ago.
+    """
+    if not os.path.isdir(JOB_DIRECTORY):
+        return
+    now = time.time()
+    for entry in os.scandir(JOB_DIRECTORY):
+        try:
+            if now - entry.stat().st_mtime > JOB_MAX_AGE:
+                os.remove(entry.path)
+        except (FileNotFoundError, IsADirectoryError):
+            pass
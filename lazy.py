@@ -0,0 +1,43 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: On-demand imports of heavy libraries
+
+import importlib
+import time
+
+IMPORT_TIMES = {}                       # module name: seconds spent importing on demand
+
+
+class LazyModule:
+    """
+    Module imported on first attribute access.
+
+    Keeps sklearn, umap, plotly express or PDF libraries out of worker startup,
+    only the first callback using them pays the import.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            start = time.perf_counter()
+            self._module = importlib.import_module(self._name)
+            IMPORT_TIMES[self._name] = time.perf_counter() - start
+            print(f'imported {self._name} on demand: {IMPORT_TIMES[self._name]:.2f} s')
+        return getattr(self._module, attribute)
+
+    def __repr__(self):
+        state = 'imported' if self._module is not None else 'not imported'
+        return f'<lazy module {self._name}, {state}>'
+
+
+def lazy(name) -> LazyModule:
+    """
+    Replaces 'import name' by import deferred until module is used.
+
+    :param name: module name, e.g. 'sklearn.manifold'
+    :return: module proxy
+    """
+    return LazyModule(name)
@@ -0,0 +1,101 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Callback latency and memory metrics, Prometheus route
+
+from dash.exceptions import PreventUpdate
+from app import server
+from lazy import lazy
+import profiling
+from prometheus_client import multiprocess
+import prometheus_client
+import functools
+import resource
+import flask
+import dash
+import json
+import time
+import os
+
+plotly_utils = lazy('plotly.utils')
+
+# gunicorn workers write metrics into this directory, route then sums all workers
+MULTIPROCESS_DIRECTORY = os.environ.get('prometheus_multiproc_dir')
+# callbacks run from milliseconds for cached pages to minutes for new extractions
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES_BUCKETS = tuple(2 ** power for power in range(10, 33, 2))           # 1 kB to 4 GB
+ROWS_BUCKETS = (10, 100, 1000, 5000, 10000, 50000, 100000, 500000, 1000000)
+
+CALLBACK_SECONDS = prometheus_client.Histogram(
+    'callback_seconds', 'Wall time of Dash callback', ['callback'], buckets=SECONDS_BUCKETS)
+CALLBACK_MEMORY = prometheus_client.Histogram(
+    'callback_peak_rss_increase_bytes', 'Growth of worker peak RSS during callback', ['callback'],
+    buckets=BYTES_BUCKETS)
+CALLBACK_ROWS = prometheus_client.Histogram(
+    'callback_input_rows', 'Rows of dataset the callback worked on', ['callback'], buckets=ROWS_BUCKETS)
+CALLBACK_COLUMNS = prometheus_client.Histogram(
+    'callback_input_columns', 'Columns of dataset the callback worked on', ['callback'], buckets=ROWS_BUCKETS)
+CALLBACK_PAYLOAD = prometheus_client.Histogram(
+    'callback_payload_bytes', 'Size of callback output json', ['callback'], buckets=BYTES_BUCKETS)
+CALLBACK_FAILURES = prometheus_client.Counter(
+    'callback_failures', 'Callbacks ended by exception other than PreventUpdate', ['callback'])
+
+
+def peak_rss() -> int:
+    # peak resident memory of this process, kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def instrument(name):
+    """
+    Records wall time, peak RSS growth, dataset shape and output size of decorated callback.
+
+    Decorator goes below app.callback, so Dash calls the instrumented function.
+    Callback is also profiled on demand, see profiling.profiled.
+    Peak RSS grows only when callback needs more memory than the worker ever had,
+    so the metric shows callbacks that push the worker to its limit.
+
+    :param name: callback label of metrics
+    :return: decorator
+    """
+    def decorator(function):
+        function = profiling.profiled(name)(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start, rss = time.perf_counter(), peak_rss()
+            try:
+                output = function(*args, **kwargs)
+            except PreventUpdate:
+                raise
+            except Exception:
+                CALLBACK_FAILURES.labels(name).inc()
+                raise
+            CALLBACK_SECONDS.labels(name).observe(time.perf_counter() - start)
+            CALLBACK_MEMORY.labels(name).observe(peak_rss() - rss)
+
+            outputs = output if isinstance(output, (list, tuple)) else [output]
+            shape = profiling.dataset_shape(list(args) + list(outputs))
+            if shape is not None:
+                CALLBACK_ROWS.labels(name).observe(shape[0])
+                CALLBACK_COLUMNS.labels(name).observe(shape[1])
+            # outputs left unchanged are not sent, rest is encoded as Dash encodes responses
+            sent = [value for value in outputs if not isinstance(value, type(dash.no_update))]
+            CALLBACK_PAYLOAD.labels(name).observe(len(json.dumps(sent, cls=plotly_utils.PlotlyJSONEncoder)))
+            return output
+        return wrapper
+    return decorator
+
+
+@server.route('/metrics')
+def metrics():
+    """
+    Exposes metrics in Prometheus text format, summed over all workers in multiprocess mode.
+
+    :return: metrics response
+    """
+    if MULTIPROCESS_DIRECTORY:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return flask.Response(prometheus_client.generate_latest(registry), mimetype=prometheus_client.CONTENT_TYPE_LATEST)
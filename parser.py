@@ -4,162 +4,605 @@
 
 import pandas as pd
 import numpy as np
-import pdftotext
+import itertools
 import argparse
-import pickle
-import tabula
-import nltk
-import pdfplumber
+import tempfile
+import glob
+import zlib
+import time
+import csv
+import sys
 import os
+import re
+from cache import NpzCache, file_digest
+from binning import RetentionBinner, N_BINS
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from lazy import lazy
+import profiling
+
+# heavy libraries are imported when first file is extracted
+pdfplumber = lazy('pdfplumber')
+tabula = lazy('tabula')
+sparse = lazy('scipy.sparse')
+
+# number of processes extracting files, all cores by default
+EXTRACT_WORKERS = int(os.environ.get('EXTRACT_WORKERS', os.cpu_count() or 1))
+# smaller batches are extracted serially, process pool startup would cost more
+PARALLEL_MIN_FILES = 8
+# same for Shimadzu reports counted by pages, see iter_shimadzu
+PARALLEL_MIN_PAGES = 8
+# reports are split into ranges of this many pages when there are fewer files than workers
+PAGES_PER_TASK = 4
+# bump version when extractor output changes, old cache entries are then ignored
+SHIMADZU_VERSION = 2
+SPECORD_VERSION = 1
+EXTRACTION_CACHE = NpzCache()
+# 'tabula-batch' extracts SPECORD files in one JVM, 'pdfplumber' without Java, 'tabula' in JVM per file
+SPECORD_ENGINE = os.environ.get('SPECORD_ENGINE', 'tabula-batch')
+# seconds between checks of files finished by tabula batch
+BATCH_POLL_INTERVAL = 0.2
+# print extraction progress to stderr, turned on by command line
+SHOW_PROGRESS = False
+OUTPUT_FORMATS = ['csv', 'parquet', 'npz']
+# keywords identifying file types, in order of priority
+FILETYPE_KEYWORDS = ['Chromatogram',     # Shimadzu
+                     'SPECORD',          # Specord
+                     'Report']           # Other
+# type is determined from this many bytes at the beginning of file
+SNIFF_BYTES = 256 * 1024
+# value columns of Shimadzu peak tables, all binned in one pass, first one is extracted by default
+SHIMADZU_COLUMNS = ['Area', 'Area%']
+FILETYPES = {}                           # file content digest: type
+EXTRACTORS = {}                          # type: extracting function
 
 
 def arg_parser() -> argparse.Namespace:
-    parser = argparse.ArgumentParser(description='Throw me some data^^')
-    parser.add_argument('-f', "--file", required=True, help="input file", nargs='*')
+    parser = argparse.ArgumentParser(
+        description='Throw me some data^^ Extracts PDFs into one binned feature matrix.',
+        epilog='Files already in extraction cache are not extracted again, so interrupted runs can be resumed.'
+    )
+    parser.add_argument('-f', "--file", required=True, help="input files, directories or glob patterns", nargs='+')
+    parser.add_argument('-o', '--output', default='features.csv', help='output file, .csv, .parquet or .npz')
+    parser.add_argument('-c', '--column', default='Area', help='extracted column of Shimadzu tables')
+    parser.add_argument('-j', '--workers', type=int, default=EXTRACT_WORKERS, help='number of extraction processes')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, help='output format, guessed from output file by default')
     return parser.parse_args()
 
 
-def get_filetype(files):
+def expand_paths(paths) -> list:
+    """
+    Expands directories and glob patterns to PDF files.
+
+    :param paths: list of files, directories or glob patterns
+    :return: list of file paths without duplicates
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            # all PDFs in directory tree
+            matches = glob.glob(os.path.join(path, '**', '*'), recursive=True)
+            matches = [file for file in matches if file.lower().endswith('.pdf')]
+        elif os.path.isfile(path):
+            matches = [path]
+        else:
+            matches = glob.glob(path, recursive=True)
+        files.extend(sorted(matches))
+    # keep order of first occurrence
+    return list(dict.fromkeys(files))
+
+
+def save_features(df: pd.DataFrame, output, output_format=None):
+    """
+    Writes feature matrix with 'file' column to csv, parquet or npz.
+
+    Npz keeps matrix sparse as csr arrays 'data', 'indices', 'indptr' and 'shape'
+    together with 'files' and column 'labels'.
+
+    :param df: dataframe from extract
+    :param output: output file path
+    :param output_format: one of OUTPUT_FORMATS, guessed from output extension by default
+    """
+    if output_format is None:
+        output_format = os.path.splitext(output)[1].lstrip('.').lower()
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'unknown output format: {output_format}')
+
+    values = df.drop(columns='file')
+    if output_format == 'csv':
+        df.to_csv(output, index=False)
+    elif output_format == 'parquet':
+        # parquet has no sparse columns, needs pyarrow or fastparquet installed
+        df.astype({column: float for column in values.columns}).to_parquet(output, index=False)
+    else:
+        if all(isinstance(dtype, pd.SparseDtype) for dtype in values.dtypes):
+            matrix = sparse.csr_matrix(values.sparse.to_coo())
+        else:
+            matrix = sparse.csr_matrix(values.to_numpy(dtype=float))
+        np.savez_compressed(
+            output,
+            data=matrix.data, indices=matrix.indices, indptr=matrix.indptr, shape=np.array(matrix.shape),
+            files=df['file'].to_numpy(dtype=str), labels=np.array([str(column) for column in values.columns])
+        )
+    print(f'saved {df.shape[0]} files x {values.shape[1]} features to {output}')
+
+
+def register_extractor(filetype):
+    """
+    Registers decorated function as extractor of filetype in EXTRACTORS.
+
+    Extractor takes list of file paths, column and number of workers and returns dataframe.
+
+    :param filetype: keyword from FILETYPE_KEYWORDS
+    :return: decorator
+    """
+    def decorator(function):
+        EXTRACTORS[filetype] = function
+        return function
+    return decorator
+
+
+def pdf_texts(data: bytes) -> list:
+    """
+    Gets searchable texts from beginning of PDF.
+
+    Raw bytes are searched as they are, flate compressed streams are inflated and
+    text pieces of TJ arrays are joined, so keywords split by kerning are found too.
+
+    :param data: first bytes of PDF
+    :return: list of bytes
+    """
+    texts = [data]
+    for stream in re.finditer(rb'stream\r?\n(.*?)endstream', data, re.DOTALL):
+        try:
+            # decompressobj tolerates streams cut at the end of sniffed bytes
+            inflated = zlib.decompressobj().decompress(stream.group(1))
+        except zlib.error:
+            continue
+        texts.append(inflated)
+        texts.append(b''.join(re.findall(rb'\(((?:[^()\\]|\\.)*)\)', inflated)))
+    return texts
+
+
+def sniff_filetype(file):
+    """
+    Determines type of one file from keywords in its first SNIFF_BYTES.
+
+    Only the first keyword of FILETYPE_KEYWORDS is trusted in raw data. Lower ones may be
+    found there while a higher one is hidden by font encoding, e.g. 'Report' of Shimadzu
+    'Analysis Report' with encoded 'Chromatogram', so they are checked in text of the first page.
+    Raw data decide only when the page has no keyword.
+
+    :param file: file path
+    :return: keyword from FILETYPE_KEYWORDS or None
     """
-    Determines imput file types.
+    with open(file, 'rb') as f:
+        texts = pdf_texts(f.read(SNIFF_BYTES))
+    found = next((keyword for keyword in FILETYPE_KEYWORDS if any(keyword.encode() in text for text in texts)), None)
+    if found == FILETYPE_KEYWORDS[0]:
+        return found
+
+    with pdfplumber.open(file) as pdf_in:
+        page0 = pdf_in.pages[0].extract_text() or ''
+    for keyword in FILETYPE_KEYWORDS:
+        if keyword in page0:
+            return keyword
+    return found
+
+
+def get_filetype(files) -> dict:
+    """
+    Determines imput file types, verdicts are cached per file content.
 
     :param files: list of paths
-    :return: dictionary {'file': 'type'}
+    :return: dictionary {'file': 'type'}, type is None for unknown files
     """
     filetypes_dict = {}
     for file in files:
-        keywords_dict = {'Chromatogram': False,     # Shimadzu
-                         'SPECORD': False,          # Specord
-                         'Report': False}           # Other
-        with open(file, "rb") as f:
-            pdf = pdftotext.PDF(f)
-        page0 = pdf[0]
-        tokens = nltk.word_tokenize(page0)
-        print(tokens)
-        for key in keywords_dict:
-            result = key in tokens
-            if result:
-                # dict with filename : type
-                filetypes_dict[file] = key
-                break
+        digest = file_digest(file)
+        if digest not in FILETYPES:
+            FILETYPES[digest] = sniff_filetype(file)
+        # dict with filename : type
+        filetypes_dict[file] = FILETYPES[digest]
+    print(f'filetypes: {filetypes_dict}')
+    return filetypes_dict
+
+
+@profiling.profiled('extract')
+def extract(files, column=None, workers=None, binner=None) -> dict:
+    """
+    Sends every file to extractor registered for its type.
+
+    :param files: list of file paths
+    :param column: extracted column, passed to extractors
+    :param workers: number of extraction processes, see iter_files
+    :param binner: binning.RetentionBinner of chromatograms, see extract_shimadzu
+    :return: dictionary {'type': dataframe}
+    """
+    files_by_type = {}
+    for file, filetype in get_filetype(files).items():
+        if filetype not in EXTRACTORS:
+            raise ValueError(f'no extractor for file {file} of type {filetype}')
+        files_by_type.setdefault(filetype, []).append(file)
+    tables = {}
+    for filetype, type_files in files_by_type.items():
+        if filetype == 'Chromatogram' and binner is not None:
+            tables[filetype] = EXTRACTORS[filetype](type_files, column, workers, binner=binner)
+        else:
+            tables[filetype] = EXTRACTORS[filetype](type_files, column, workers)
+    return tables
+
 
-    # print(filetypes_dict)
+def spectral_numbers(df_list) -> pd.DataFrame:
+    """
+    Collects all numbers from tables of one SPECORD file.
+
+    :param df_list: list of dataframes, tables from one file
+    :return: dataframe, one row per table cell with numbers
+    """
+    # from list make one pd.DataFrame
+    df = pd.concat(df_list, axis=1)
+    # make one column for each file
+    df = df.stack(dropna=True).reset_index(drop=True).to_frame('Data').sort_values('Data')
+    df = df.pop('Data').astype(str).str.extractall(r'(\d+.\d+)')[0].unstack().astype('float')
+    return df
 
 
-def extract_spectrals(files) -> pd.DataFrame:
+def extract_spectrals_table(file) -> pd.DataFrame:
     """
-    Extract all table data from '' filetypes.
+    Extracts all numbers from tables in one SPECORD type file, every call starts new JVM.
 
-    :param files:
+    :param file: file path
+    :return: dataframe
+    """
+    print(f'extracting SPECORD file: {file}')
+    # create list of pd.DataFrames from one file
+    df_list = tabula.read_pdf(file, pages='all', multiple_tables=True)
+    return spectral_numbers(df_list)
+
+
+def extract_spectrals_plumber(file) -> pd.DataFrame:
+    """
+    Extracts all numbers from tables in one SPECORD type file with pdfplumber, without Java.
+
+    :param file: file path
+    :return: dataframe
+    """
+    print(f'extracting SPECORD file: {file}')
+    df_list = []
+    with pdfplumber.open(file) as pdf_in:
+        for page in pdf_in.pages:
+            for table in page.extract_tables():
+                # first row is header, same as in tabula
+                df_list.append(pd.DataFrame(table[1:], columns=table[0]))
+            page.flush_cache()
+    return spectral_numbers(df_list)
+
+
+def read_csv_rows(file) -> pd.DataFrame:
+    # tables of one file are written one under another, rows have different lengths
+    with open(file, newline='') as f:
+        return pd.DataFrame(list(csv.reader(f)))
+
+
+def iter_spectrals_batch(files):
+    """
+    Extracts SPECORD files by tabula in one JVM.
+
+    Files are linked into temporary directory converted by one tabula batch call.
+    Frames are yielded as soon as JVM moves on to the next file.
+
+    :param files: list of file paths
+    :return: generator of (file, dataframe) pairs in order of completion
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        names = {}                                      # csv name: file
+        for i, file in enumerate(files):
+            name = f'{i:06d}'
+            os.symlink(os.path.abspath(file), os.path.join(directory, name + '.pdf'))
+            names[name + '.csv'] = file
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            batch = executor.submit(
+                tabula.convert_into_by_batch, directory, output_format='csv', pages='all')
+            while names:
+                finished = batch.done()
+                written = sorted(
+                    (entry.stat().st_mtime, entry.name) for entry in os.scandir(directory)
+                    if entry.name in names
+                )
+                if not finished:
+                    # newest csv may be still written
+                    written = written[:-1]
+                    time.sleep(BATCH_POLL_INTERVAL)
+                for _, name in written:
+                    print(f'extracted SPECORD file: {names[name]}')
+                    df = read_csv_rows(os.path.join(directory, name))
+                    yield names.pop(name), spectral_numbers([df])
+                if finished:
+                    # raises JVM errors, files without tables produce no csv
+                    batch.result()
+                    for file in names.values():
+                        yield file, pd.DataFrame()
+                    break
+
+
+def iter_spectrals(files, engine=None, workers=1):
+    """
+    Extracts SPECORD files and yields them as they finish.
+
+    :param files: list of file paths
+    :param engine: 'tabula-batch' for one JVM per batch, 'pdfplumber' for pure Python,
+                   'tabula' for one JVM per file, SPECORD_ENGINE by default
+    :param workers: number of extraction processes, not used by 'tabula-batch'
+    :return: generator of (file, dataframe) pairs in order of completion
+    """
+    if engine is None:
+        engine = SPECORD_ENGINE
+    if engine == 'tabula-batch':
+        return iter_spectrals_batch(files)
+    elif engine == 'pdfplumber':
+        return zip(files, iter_files(extract_spectrals_plumber, files, workers))
+    elif engine == 'tabula':
+        return zip(files, iter_files(extract_spectrals_table, files, workers))
+    raise ValueError(f'unknown SPECORD engine: {engine}')
+
+
+@register_extractor('SPECORD')
+@profiling.profiled('extract_spectrals')
+def extract_spectrals(files, column=None, workers=1, engine=None) -> pd.DataFrame:
+    """
+    Extract all table data from SPECORD filetypes.
+
+    :param files: list of file paths
+    :param column: not used, all numbers are extracted
+    :param workers: number of extraction processes, see iter_spectrals
+    :param engine: extraction engine, see iter_spectrals
     :return: dataframe
     """
     print(f'extract_spectrals')
-    dff = pd.DataFrame()
-    for file in files:
-        print(f'extracting SPECORD file: {file}')
-        # create list of pd.DataFrames from one file
-        df_list = tabula.read_pdf(file, pages='all', multiple_tables=True)
-        # from list make one pd.DataFrame
-        df = pd.concat(df_list, axis=1)
-        # make one column for each file
-        df = df.stack(dropna=True).reset_index(drop=True).to_frame('Data').sort_values('Data')
-        df = df.pop('Data').str.extractall(r'(\d+.\d+)')[0].unstack().astype('float')
-        df['file'] = file
-        dff = dff.append(df)
-    return dff
+    if engine is None:
+        engine = SPECORD_ENGINE
+    tables = extract_cached(
+        f'spectrals-{engine}', SPECORD_VERSION, files,
+        lambda missing: iter_spectrals(missing, engine, workers)
+    )
+    return pd.concat(tables)
 
 
 def get_shimadzu_columns(file):
-    columns = ['Area', 'Area%']
-    return columns
+    return SHIMADZU_COLUMNS
 
 
-def extract_shimadzu(files, column=None) -> (pd.DataFrame, list):
+def shimadzu_page_tables(task) -> list:
     """
-    Extracts  specific column from tables in Shimadzu type files.
+    Extracts raw tables from range of pages of one Shimadzu type file.
+
+    Module level function taking one argument, so page ranges can be sent to worker processes.
+    Layout of every page is dropped as soon as its table is read and file is closed at the end,
+    so long-lived workers keep neither file handles nor pages.
+
+    :param task: (file path, first page, end page), end page None for all pages
+    :return: list of tables, one per page, table is list of rows
+    """
+    file, first, end = task
+    tables = []
+    with pdfplumber.open(file) as pdf_in:
+        for page in pdf_in.pages[first:end]:
+            # in case of empty page pdfplumber extract NoneType
+            tables.append(page.extract_table() or [])
+            page.flush_cache()
+    return tables
+
+
+def shimadzu_frame(tables) -> pd.DataFrame:
+    """
+    Joins peak table split across pages.
+
+    Rows above header are title and detector, next pages continue with or without header,
+    "Total" row ends the table.
+
+    :param tables: tables of consecutive pages, see shimadzu_page_tables
+    :return: dataframe with 'Ret. Time', 'Area' and 'Area%' columns
+    """
+    header, rows = None, []
+    for row in (row for table in tables for row in table):
+        if 'Ret. Time' in row:
+            header = row
+        elif header is None or not row:
+            continue
+        elif str(row[0] or '').startswith('Total'):
+            break
+        else:
+            rows.append(row)
+    df = pd.DataFrame(rows, columns=header if header is not None else ['Ret. Time', 'Area', 'Area%'])
+    # save relevant columns
+    df = df[['Ret. Time', 'Area', 'Area%']].replace('', np.nan).dropna()
+    df = df.astype({"Area%": float, "Area": int, "Ret. Time": float})
+    return df
+
+
+def extract_shimadzu_table(file) -> pd.DataFrame:
+    """
+    Extracts peak table from all pages of one Shimadzu type file.
+
+    Module level function, so it can be sent to worker processes.
+
+    :param file: file path
+    :return: dataframe with 'Ret. Time', 'Area' and 'Area%' columns
+    """
+    return shimadzu_frame(shimadzu_page_tables((file, 0, None)))
+
+
+def page_count(file) -> int:
+    with pdfplumber.open(file) as pdf_in:
+        return len(pdf_in.pages)
 
 
+def iter_shimadzu(files, workers=None):
+    """
+    Extracts Shimadzu type files, pages of long reports in parallel.
+
+    Files are extracted one per task when there are enough of them to keep workers busy.
+    Fewer files than workers are split into ranges of PAGES_PER_TASK pages,
+    so one long report is extracted by several processes, tables are then joined per file.
+    Pages are counted first, reports of fewer than PARALLEL_MIN_PAGES pages in total are extracted serially.
+
     :param files: list of file paths
-    :param column:
-    :return:dataframe with all tables from all files
+    :param workers: number of worker processes, see iter_files
+    :return: generator of (file, dataframe) pairs in the order of input files
     """
+    if not workers:
+        workers = EXTRACT_WORKERS
+    if workers <= 1 or len(files) >= workers:
+        yield from zip(files, iter_files(extract_shimadzu_table, files, workers))
+        return
 
-    dff = pd.DataFrame()
-    for file in files:
-        # check cache
-        df = pd.DataFrame()
-        df = cache(df, file + '.pkl')
-
-        if df.empty:
-            pdf_in = pdfplumber.open(file)
-            page = pdf_in.pages[0]
-            # if page.extract_table() is not None:
-            # in case of empty page pdfplumber extract NoneType
-            df_list = page.extract_table()
-            df = pd.DataFrame(df_list)
-            # create header and drop redundant rows
-            columns = df.iloc[2]
-            df.columns = columns
-            df = df.drop([0, 1, 2])
-            # drop last "total" row
-            df = df.iloc[:-1]
-            # concatenate table data from one file to dataframe
-            # save relevant columns
-            df = df[['Ret. Time', 'Area', 'Area%']].dropna()
-            df = df.astype({"Area%": float, "Area": int, "Ret. Time": float})
-            df['file'] = file
-            df = cache(df, file + '.pkl')
-
-        dff = dff.append(df)
-    # select only relevant rows  and drop last row ( total + NaNs )
-    if column is not None:
-        print(f'in parser extracting column: {column}')
-        dff = dff[['Ret. Time', column, 'file']].dropna()
+    pages = [page_count(file) for file in files]
+    if sum(pages) < PARALLEL_MIN_PAGES:
+        # few short reports, process pool startup would cost more
+        yield from zip(files, iter_files(extract_shimadzu_table, files, 1))
+        return
+    tasks, owners = [], []                              # page range, position of its file
+    for i, (file, n_pages) in enumerate(zip(files, pages)):
+        for first in range(0, max(1, n_pages), PAGES_PER_TASK):
+            tasks.append((file, first, first + PAGES_PER_TASK))
+            owners.append(i)
+    # iter_files keeps order of tasks, ranges of one file come one after another
+    results = zip(owners, iter_files(shimadzu_page_tables, tasks, workers, min_parallel=1, unit='page ranges'))
+    for i, ranges in itertools.groupby(results, key=lambda result: result[0]):
+        yield files[i], shimadzu_frame([table for _, tables in ranges for table in tables])
+
+
+def iter_files(function, files, workers=None, min_parallel=PARALLEL_MIN_FILES, unit='files'):
+    """
+    Applies function on every file, in a pool of processes for larger batches.
+
+    Results are yielded one by one, so callers can store them before the whole batch is done.
+
+    :param function: module level function taking one file path
+    :param files: list of file paths
+    :param workers: number of worker processes, None or 0 for EXTRACT_WORKERS, 1 runs serially
+    :param min_parallel: smaller batches are extracted serially
+    :param unit: what items of files are, shown in progress
+    :return: generator of results in the order of input files
+    """
+    if not workers:
+        workers = EXTRACT_WORKERS
+    workers = min(workers, len(files))
+    executor = None
+    if workers <= 1 or len(files) < min_parallel:
+        results = map(function, files)
     else:
-        print(f'extracting column:area')
-        dff = dff[['Ret. Time', 'Area', 'file']].dropna()
-    print(f'dff: {dff}')
-    dff['bins_RT'] = pd.cut(dff['Ret. Time'], 400).astype(str)
-    dff = dff.pivot(index='file', columns='bins_RT', values=column)
-    dff = dff.replace(np.nan, 0)
-    # coly index 'file' to be represented in datatable
-    dff.reset_index(level=0, inplace=True)
+        print(f'extracting {len(files)} {unit} in {workers} processes')
+        # bigger chunks lower inter-process overhead, several chunks per worker keep load balanced
+        chunksize = max(1, len(files) // (workers * 4))
+        executor = ProcessPoolExecutor(max_workers=workers)
+        # executor.map yields results in the order of input files
+        results = executor.map(function, files, chunksize=chunksize)
 
-    return dff
+    start = time.perf_counter()
+    done = 0
+    try:
+        for done, result in enumerate(results, start=1):
+            if SHOW_PROGRESS:
+                elapsed = time.perf_counter() - start
+                print(f'\rextracted {done}/{len(files)} {unit}, {elapsed:.1f} s', end='', file=sys.stderr)
+            yield result
+    finally:
+        if SHOW_PROGRESS:
+            print(file=sys.stderr)
+        if executor is not None:
+            # do not block when caller stopped early, finished pool is joined
+            # so worker processes and their pipes are released right away
+            executor.shutdown(wait=done == len(files))
 
 
-def cache(df: pd.DataFrame, cache_file: str) -> pd.DataFrame:
+def extract_cached(name, version, files, extract_files) -> list:
     """
-    Simple cache to speed up data extraction.
+    Extracts files, files found in extraction cache are not extracted again.
 
-    :param df:
-    :param cache_file:
-    :return:
+    :param name: extractor name, part of the cache key
+    :param version: version of extractor output, part of the cache key
+    :param files: list of file paths
+    :param extract_files: function extracting list of files to iterable of (file, dataframe) pairs
+    :return: list of dataframes with 'file' column, in the order of input files
     """
+    keys = {file: EXTRACTION_CACHE.key(file, name, version) for file in files}
+    tables = {file: EXTRACTION_CACHE.get(key) for file, key in keys.items()}
+    missing = [file for file, df in tables.items() if df is None]
+    if missing:
+        for file, df in extract_files(missing):
+            EXTRACTION_CACHE.put(keys[file], df)
+            tables[file] = df
+    print(f'extraction cache: {EXTRACTION_CACHE.stats()}')
 
-    if os.path.exists(cache_file):
-        # Load the cached data from the file.
-        with open(cache_file, mode='rb') as file:
-            df_cache = pickle.load(file)
+    for file, df in tables.items():
+        df['file'] = file
+    return [tables[file] for file in files]
 
-        print("- Data loaded: " + cache_file)
 
-    else:
-        # The cache-file does not exist. Create cache file.
-        if df.empty:
-            # when checking cache dataframe should be empty
-            # because it happens at the start of extract function
-            # if its not empty -> create cache file
-            return df
-        else:
-            with open(cache_file, mode='wb') as file:
-                pickle.dump(df, file)
-                df_cache = df
-            print("+ Data saved: " + cache_file)
+@register_extractor('Chromatogram')
+@profiling.profiled('extract_shimadzu')
+def extract_shimadzu(files, column=None, workers=None, binner=None) -> pd.DataFrame:
+    """
+    Extracts  specific column from tables in Shimadzu type files.
+
+    Peaks are summed into retention time bins, one row per file.
+    All SHIMADZU_COLUMNS are binned at once, so other column of the same files
+    is taken from binner without extracting or binning again.
+    When binner is given, only files not binned yet are extracted and appended
+    to its fixed grid, rows of other files are reused as they are.
+    New peaks outside the grid reset the binner, all files are then binned on new grid,
+    so the table never depends on the order files were added in.
+
+    :param files: list of file paths
+    :param column: returned column, first of SHIMADZU_COLUMNS by default
+    :param workers: number of extraction processes, see iter_shimadzu
+    :param binner: binning.RetentionBinner, new 400 bins grid over all peaks by default
+    :return:dataframe with all tables from all files
+    """
+    if binner is None:
+        binner = RetentionBinner(n_bins=N_BINS)
+
+    if column is None:
+        column = SHIMADZU_COLUMNS[0]
+    print(f'in parser extracting column: {column}')
+
+    def peak_table(selected) -> pd.DataFrame:
+        # concatenate table data from selected files to one dataframe
+        dff = pd.concat(extract_cached(
+            'extract_shimadzu_table', SHIMADZU_VERSION, selected,
+            lambda missing: iter_shimadzu(missing, workers)
+        ))
+        # select only relevant columns
+        return dff[['Ret. Time', 'file'] + SHIMADZU_COLUMNS].dropna()
+
+    new_files = [file for file in files if file not in binner]
+    if new_files:
+        dff = peak_table(new_files)
+        if len(binner):
+            outside = int((binner.bin_indices(dff['Ret. Time'].to_numpy(dtype=float)) < 0).sum())
+            if outside:
+                # grid of earlier files would drop these peaks, all files get new grid,
+                # earlier files are read from extraction cache
+                print(f'{outside} peaks of new files outside retention grid, binning all files again')
+                binner.reset()
+                dff = peak_table(files)
+        print(f'dff: {dff}')
+        binner.add(dff['file'], dff['Ret. Time'], dff[SHIMADZU_COLUMNS])
 
-    return df_cache
+    # column 'file' to be represented in datatable
+    return binner.to_frame(files, column)
 
 
 if __name__ == '__main__':
     args = arg_parser()
-    extract_shimadzu(['realdata/dalsi/D.pdf', 'realdata/dalsi/D copy.pdf', 'realdata/dalsi/D copy 2.pdf'])
+    SHOW_PROGRESS = True
+    input_files = expand_paths(args.file)
+    if not input_files:
+        sys.exit('no input files found')
+    print(f'extracting {len(input_files)} files')
+    tables = extract(input_files, args.column, args.workers)
+    if len(tables) > 1:
+        sys.exit(f'mixed file types: {list(tables)}, extract them separately')
+    save_features(tables.popitem()[1], args.output, args.format)
@@ -0,0 +1,148 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Opt-in cProfile of callbacks and extraction
+
+from lazy import lazy
+import functools
+import threading
+import cProfile
+import json
+import time
+import sys
+import os
+
+flask = lazy('flask')
+
+# 'all' or comma separated names of profiled functions, nothing is profiled by default
+PROFILE = os.environ.get('PROFILE', '')
+# requests with header 'X-Profile: <token>' are profiled too, header is ignored without token
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_HEADER = 'X-Profile'
+PROFILE_DIRECTORY = os.environ.get('PROFILE_DIR', os.path.join('uploaded_files', '.profiles'))
+# newest profiles kept, older are removed when new one is written
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 100))
+# longer parameter values are cut in metadata
+MAX_PARAMETER_CHARS = 200
+
+_active = threading.local()             # profiler of this thread, cProfile cannot nest
+
+
+def dataset_shape(values) -> tuple:
+    """
+    Finds dataset handle among callback inputs or outputs.
+
+    :param values: callback arguments or outputs
+    :return: (rows, columns), None when no handle is found
+    """
+    for value in values:
+        if isinstance(value, dict):
+            # background jobs keep the handle under 'dataset'
+            handle = value.get('dataset') if isinstance(value.get('dataset'), dict) else value
+            if 'rows' in handle and 'columns' in handle:
+                return handle['rows'], handle['columns']
+    return None
+
+
+def requested(name) -> bool:
+    if PROFILE == 'all' or name in PROFILE.split(','):
+        return True
+    # flask is loaded only by the web app, command line extraction never has a request
+    if PROFILE_TOKEN and 'flask' in sys.modules and flask.has_request_context():
+        return flask.request.headers.get(PROFILE_HEADER) == PROFILE_TOKEN
+    return False
+
+
+def parameter(value):
+    # metadata keeps parameters short, numbers and dataset handles as they are
+    if isinstance(value, (list, tuple)) and len(value) > 3:
+        return f'{len(value)} items, first {parameter(value[0])}'
+    if isinstance(value, (int, float, bool, type(None))) or isinstance(value, dict) and 'rows' in value:
+        return value
+    return repr(value)[:MAX_PARAMETER_CHARS]
+
+
+def rotate():
+    profiles = sorted(entry.path for entry in os.scandir(PROFILE_DIRECTORY) if entry.name.endswith('.prof'))
+    for path in profiles[:max(0, len(profiles) - PROFILE_KEEP)]:
+        for file in [path, path[:-len('.prof')] + '.json']:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+
+
+def write(name, profiler, seconds, args, kwargs, result):
+    """
+    Stores profile as pstats file with metadata json next to it.
+
+    :param name: profiled function
+    :param profiler: finished cProfile.Profile
+    :param seconds: wall time
+    :param args: positional arguments of the call
+    :param kwargs: keyword arguments of the call
+    :param result: return value, searched for dataset handle or dataframe
+    """
+    os.makedirs(PROFILE_DIRECTORY, exist_ok=True)
+    now = time.time()
+    # names sort by time, rotate removes the first ones
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(now)) + f'{now % 1:.6f}'[1:]
+    base = os.path.join(PROFILE_DIRECTORY, f'{stamp}-{name}-{os.getpid()}')
+    outputs = list(result) if isinstance(result, (list, tuple)) else [result]
+    shape = dataset_shape(list(args) + list(kwargs.values()) + outputs)
+    if shape is None:
+        # extractors return dataframe, parser.extract dictionary of them
+        frames = result.values() if isinstance(result, dict) else outputs
+        shape = next((tuple(frame.shape) for frame in frames if hasattr(frame, 'shape')), None)
+    metadata = {
+        'function': name,
+        'seconds': seconds,
+        'shape': shape,
+        'args': [parameter(value) for value in args],
+        'kwargs': {key: parameter(value) for key, value in kwargs.items()},
+    }
+    profiler.dump_stats(base + '.prof')
+    with open(base + '.json', 'w') as f:
+        json.dump(metadata, f, indent=2, default=repr)
+    rotate()
+    print(f'profile of {name}: {base}.prof, {seconds:.2f} s')
+
+
+def profiled(name):
+    """
+    Profiles decorated function when PROFILE names it or request carries profiling header.
+
+    Otherwise function is called directly, with profiling off the check costs two truth tests.
+    Calls nested in profiled call are part of its profile.
+    Background jobs run without request, callbacks pass profiling to them, see jobs.submit.
+    Profiles are read by: python -m pstats <file>.prof, or snakeviz.
+
+    :param name: function name used by PROFILE and in profile file names
+    :return: decorator
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not (PROFILE or PROFILE_TOKEN) or getattr(_active, 'profiler', None) is not None \
+                    or not requested(name):
+                return function(*args, **kwargs)
+            return call(name, function, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def call(name, function, *args, **kwargs):
+    """
+    Calls function under profiler and writes its profile, e.g. in job process where no request decides.
+
+    :param name: name used in profile file names
+    :param function: profiled function
+    :return: return value of function
+    """
+    profiler = _active.profiler = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        result = profiler.runcall(function, *args, **kwargs)
+    finally:
+        _active.profiler = None
+    write(name, profiler, time.perf_counter() - start, args, kwargs, result)
+    return result
@@ -0,0 +1,9 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Tests import application modules from repository root
+
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
@@ -0,0 +1,36 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Filter queries evaluated over datasets
+
+import numpy as np
+
+from dataset import Dataset
+import filtering
+
+
+def float32_dataset() -> Dataset:
+    values = np.array([[0.1], [1.3476], [2.0]])
+    return Dataset(values, ['a.pdf', 'b.pdf', 'c.pdf'], names=['x'])
+
+
+def test_value_copied_from_table_matches():
+    data = float32_dataset()
+    for row, record in enumerate(data.records(slice(None))):
+        value = record['x']
+        assert filtering.filter_rows(data, f'{{x}} = {value}').tolist() == [row]
+        assert row in filtering.filter_rows(data, f'{{x}} <= {value}')
+        assert row not in filtering.filter_rows(data, f'{{x}} > {value}')
+
+
+def test_operator_words_after_operator_are_values():
+    assert filtering.parse('{file} contains ne') == ('contains', 'file', 'ne')
+    assert filtering.parse('{file} = lt') == ('=', 'file', 'lt')
+    assert filtering.parse('{file} scontains and || {file} ieq sne') == \
+        ('||', ('contains', 'file', 'and'), ('i=', 'file', 'sne'))
+
+
+def test_operator_words_filter_rows():
+    data = Dataset(np.zeros((3, 1)), ['line.pdf', 'LT.pdf', 'x.pdf'], names=['x'])
+    assert filtering.filter_rows(data, '{file} contains ne').tolist() == [0]
+    assert filtering.filter_rows(data, '{file} icontains lt and {x} eq 0').tolist() == [1]
+    assert filtering.filter_rows(data, 'not {file} = lt').tolist() == [0, 1, 2]
@@ -0,0 +1,16 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Smoke test of the application entry point
+
+import importlib
+
+from conftest import ROOT
+
+
+def test_index_imports(monkeypatch):
+    # index reads logos relative to working directory, as gunicorn runs it
+    monkeypatch.chdir(ROOT)
+    index = importlib.import_module('index')
+    layout = index.serve_layout()
+    assert layout is not None
+    assert '/upload' in {rule.rule for rule in index.app.server.url_map.iter_rules()}
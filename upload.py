@@ -0,0 +1,72 @@
+# Author: libor@labavit.com
+# Year: 2021
+# Desc.: Streaming file upload route
+
+from app import server
+import hashlib
+import flask
+import os
+import re
+
+DIRECTORY = "uploaded_files"
+# partially received files, moved to DIRECTORY/<file id>/<name> when complete
+PARTIAL_DIRECTORY = os.path.join(DIRECTORY, '.partial')
+CHUNK_SIZE = 2 ** 20
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_MB', 200)) * 2 ** 20
+# file id is the beginning of sha256 of file content
+FILE_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def file_path(file_id) -> str:
+    """
+    Finds uploaded file.
+
+    :param file_id: id returned by upload route
+    :return: path to file, DIRECTORY/<file id>/<name>
+    """
+    if not FILE_ID.match(file_id):
+        raise ValueError(f'invalid file id: {file_id}')
+    directory = os.path.join(DIRECTORY, file_id)
+    return os.path.join(directory, os.listdir(directory)[0])
+
+
+@server.route('/upload', methods=['POST'])
+def upload():
+    """
+    Receives one file as raw request body and writes it to disk chunk by chunk.
+
+    Content is hashed while received, same file uploaded again is stored only once.
+    Browser sends file via assets/upload.js, callbacks get only file ids.
+
+    :return: json {'id': file id, 'name': file name, 'size': bytes}
+    """
+    name = os.path.basename(flask.request.args.get('name', '').replace('\\', '/')).strip()
+    if name in ('', '.', '..'):
+        return flask.jsonify(error='missing file name'), 400
+
+    os.makedirs(PARTIAL_DIRECTORY, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    partial = os.path.join(PARTIAL_DIRECTORY, f'{os.getpid()}-{os.urandom(8).hex()}')
+    try:
+        with open(partial, 'wb') as fp:
+            for chunk in iter(lambda: flask.request.stream.read(CHUNK_SIZE), b''):
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    return flask.jsonify(error=f'file {name} is larger than {MAX_UPLOAD_BYTES} bytes'), 413
+                digest.update(chunk)
+                fp.write(chunk)
+
+        file_id = digest.hexdigest()[:32]
+        directory = os.path.join(DIRECTORY, file_id)
+        if os.path.isdir(directory):
+            print(f'File {name} exists, skipping upload.')
+        else:
+            print(f'Uploading file: {name}')
+            os.makedirs(directory, exist_ok=True)
+            os.replace(partial, os.path.join(directory, name))
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+    return flask.jsonify(id=file_id, name=name, size=size)